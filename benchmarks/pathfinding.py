@@ -0,0 +1,135 @@
+import sys
+sys.path.insert(0, '')
+import __builtin__
+import random
+from time import time, sleep
+from settings import Settings
+from map_model.map import Map
+from map_model.jps import octile
+from map_model.pathpool import PathPool, PENDING
+
+MAPS = ('bigmap.yaml', 'test_map.yaml')
+QUERIES = 300
+REPEAT = 3
+CLUSTER_SIZE = 10
+WORKERS = (1, 2, 4)
+
+
+def path_cost(start, path):
+    cost, prev = 0, start
+    for pos in path:
+        cost += octile(prev, pos)
+        prev = pos
+    return cost
+
+
+def get_queries(map, pred, count, seed=0):
+    rand = random.Random(seed)
+    squares = sorted(pos for pos, info in map if pred(pos))
+    return [(rand.choice(squares), rand.choice(squares)) for _ in range(count)]
+
+
+def run(map, queries, pred, algorithm):
+    """ returns results, the best time of REPEAT runs
+    and expanded nodes of one run """
+    best_time = float('inf')
+    for _ in range(REPEAT):
+        map.expanded_nodes = 0
+        results = []
+        start_time = time()
+        for start, end in queries:
+            results.append(map.get_path(start, end, pred, algorithm))
+        best_time = min(best_time, time() - start_time)
+    return results, best_time, map.expanded_nodes
+
+
+def run_prefix(map, queries, pred):
+    """ the same as run for the beginnings of paths (hierarchical layer) """
+    best_time = float('inf')
+    for _ in range(REPEAT):
+        map.expanded_nodes = 0
+        results = []
+        start_time = time()
+        for start, end in queries:
+            results.append(map.get_path_prefix(start, end, pred))
+        best_time = min(best_time, time() - start_time)
+    return results, best_time, map.expanded_nodes
+
+
+def run_pool(map, queries, workers):
+    """ the same as run for the path pool, returns results, the best time
+    until all results are received, the best time spent in the main
+    process (in submit and result) and expanded nodes of one run """
+    pool = PathPool(map, workers)
+    best_time = best_main_time = float('inf')
+    try:
+        for _ in range(REPEAT):
+            start_time = time()
+            keys = [pool.submit(start, end) for start, end in queries]
+            main_time = time() - start_time
+            results = []
+            for key in keys:
+                while True:
+                    call_time = time()
+                    result = pool.result(key)
+                    main_time += time() - call_time
+                    if result is not PENDING:
+                        break
+                    sleep(.001) # a frame of the game
+                results.append(result.path)
+            best_time = min(best_time, time() - start_time)
+            best_main_time = min(best_main_time, main_time)
+    finally:
+        pool.close()
+    return results, best_time, best_main_time, pool.expanded // REPEAT
+
+
+def main():
+    for name in MAPS:
+        maps = Map(name), Map(name, dense=True)
+        queries = None
+        reference = None
+        for map, algorithm in ((m, a) for m in maps for a in m.path_algorithms):
+            pred = lambda pos: map.has_action(pos, 'walk')
+            if queries is None:
+                queries = get_queries(map, pred, QUERIES)
+                print "Map '{0}', {1} queries".format(name, len(queries))
+            results, seconds, expanded = run(map, queries, pred, algorithm)
+            if reference is None:
+                reference = results
+            mismatches = 0
+            for (start, end), res, ref in zip(queries, results, reference):
+                if (res is None) != (ref is None):
+                    mismatches += 1
+                elif (res is not None and
+                      abs(path_cost(start, res) - path_cost(start, ref)) > 1e-9):
+                    mismatches += 1
+            storage = 'dense' if map.dense else 'dict'
+            print ('  {0:>5} {1:>5}: {2:8.1f} ms, {3:7} expanded nodes, '
+                   '{4} length mismatches').format(storage, algorithm,
+                                                   seconds * 1000, expanded,
+                                                   mismatches)
+        map = Map(name, dense=True, cluster_size=CLUSTER_SIZE)
+        pred = lambda pos: map.has_action(pos, 'walk')
+        results, seconds, expanded = run_prefix(map, queries, pred)
+        mismatches = sum(1 for res, ref in zip(results, reference)
+                         if (res is None) != (ref is None))
+        print ('  dense   hpa: {0:8.1f} ms, {1:7} expanded nodes, '
+               '{2} reachability mismatches (path prefixes)').format(
+                    seconds * 1000, expanded, mismatches)
+        for workers in WORKERS:
+            results, seconds, main_seconds, expanded = run_pool(map, queries,
+                                                                workers)
+            mismatches = sum(
+                1 for (start, end), res, ref in zip(queries, results, reference)
+                if (res is None) != (ref is None) or (res is not None and
+                    abs(path_cost(start, res) - path_cost(start, ref)) > 1e-9))
+            print ('  pool of {0} jps: {1:8.1f} ms, {2:8.1f} ms in the main '
+                   'process, {3:7} expanded nodes, {4} length mismatches'
+                   ).format(workers, seconds * 1000, main_seconds * 1000,
+                            expanded, mismatches)
+
+
+if __name__ == '__main__':
+    __builtin__.S = Settings('settings.yaml')
+    main()
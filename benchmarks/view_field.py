@@ -0,0 +1,86 @@
+import sys
+sys.path.insert(0, '')
+import __builtin__
+import random
+from time import time
+from settings import Settings
+from map_model.map import Map
+
+MAPS = ('bigmap.yaml', 'test_map.yaml')
+QUERIES = 300
+REPEAT = 3
+
+
+def get_queries(map, count, seed=0):
+    """ positions and directions of NPCs with normal and excited views """
+    rand = random.Random(seed)
+    squares = sorted(pos for pos, info in map if map.has_action(pos, 'walk'))
+    views = ((S.npc['normal_view_radius'], S.npc['normal_view_angle']),
+             (S.npc['excited_view_radius'], S.npc['excited_view_angle']))
+    return [(rand.choice(squares), rand.randrange(360)) + rand.choice(views)
+            for _ in range(count)]
+
+
+def run(map, queries, pred, algorithm):
+    """ returns results and the best time of REPEAT runs """
+    best_time = float('inf')
+    for _ in range(REPEAT):
+        results = []
+        start_time = time()
+        for pos, angle, radius, cone_angle in queries:
+            results.append(set(map.view_field(pos, angle, cone_angle, radius,
+                                              pred, algorithm)))
+        best_time = min(best_time, time() - start_time)
+    return results, best_time
+
+
+def run_can_see(map, queries, targets):
+    """ returns answers for the targets and the best time of REPEAT runs """
+    best_time = float('inf')
+    for _ in range(REPEAT):
+        start_time = time()
+        answers = [map.can_see(pos, angle, cone_angle, radius, target)
+                   for (pos, angle, radius, cone_angle), target
+                   in zip(queries, targets)]
+        best_time = min(best_time, time() - start_time)
+    return answers, best_time
+
+
+def main():
+    for name in MAPS:
+        map = Map(name, dense=True)
+        pred = None # the 'see' action
+        queries = get_queries(map, QUERIES)
+        print "Map '{0}', {1} queries".format(name, len(queries))
+        reference = None
+        for algorithm in map.fov_algorithms:
+            map.sight_edges.tests = map.crossing_pairs = 0
+            results, seconds = run(map, queries, pred, algorithm)
+            if reference is None:
+                reference = results
+            differences = sum(len(res ^ ref)
+                              for res, ref in zip(results, reference))
+            print ('  {0:>10}: {1:8.1f} ms, {2} squares differ '
+                   'from {3}, {4} segment tests').format(
+                       algorithm, seconds * 1000, differences,
+                       map.fov_algorithms[0],
+                       map.sight_edges.tests + map.crossing_pairs)
+        # a point target, the player is usually near
+        rand = random.Random(1)
+        targets = [(pos[0] + rand.randint(-radius, radius),
+                    pos[1] + rand.randint(-radius, radius))
+                   for pos, angle, radius, cone_angle in queries]
+        map.fov_algorithm = 'shadowcast' # the line of sight test
+        answers, seconds = run_can_see(map, queries, targets)
+        fields = run(map, queries, pred, 'shadowcast')[0]
+        differences = sum(1 for answer, target, field
+                          in zip(answers, targets, fields)
+                          if answer != (target in field))
+        print ('  {0:>10}: {1:8.1f} ms, {2} answers differ '
+               'from shadowcast').format('can_see', seconds * 1000,
+                                         differences)
+
+
+if __name__ == '__main__':
+    __builtin__.S = Settings('settings.yaml')
+    main()
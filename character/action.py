@@ -1,10 +1,20 @@
-from uuid import uuid4
+from bisect import bisect_left
 from functools import wraps
 from types import GeneratorType
 from direct.interval.ActorInterval import ActorInterval
 from direct.interval.LerpInterval import LerpNodePathInterval
+from character.timers import TimerWheel
+from character.movement import Movement
 
+TICK = 1 / 60.0 # resolution of the timer wheel in seconds
+# upper bounds of bins of the histogram of resume latency in milliseconds
+LATENCY_BINS = (0, 1, 2, 5, 10, 20, 50, 100)
 _testing = False
+_wheel = None
+# [interval, end time, character, generator, seen running]
+_intervals = []
+_movement = Movement()
+_latencies = {} # action name -> counts of LATENCY_BINS and more
 
 def set_testing(value):
     global _testing
@@ -33,31 +43,36 @@ def _runner(char, gen, send_value=None):
         yielded = gen.send(send_value)
     except StopIteration:
         char.action = None
+        char.action_done()
         return
-    key = uuid4().hex
-
-    def timeout_handler(task):
-        if key not in char.action_timeouts:
-            return
-        char.action_timeouts.remove(key)
-        _runner(char, gen)
 
     if isinstance(yielded, wait):
-        def callback(task):
-            _runner(char, gen)
-        taskMgr.doMethodLater(yielded.seconds, callback, key)
-    elif isinstance(yielded, (LerpNodePathInterval, ActorInterval)):
+        due = globalClock.getFrameTime() + yielded.seconds
         def callback():
-            if key not in char.action_timeouts:
-                return
-            char.action_timeouts.remove(key)
+            _record_latency(char, due)
             _runner(char, gen)
-        char.action_timeouts.append(key)
-        base.acceptOnce(key, callback)
-        yielded.setDoneEvent(key) # sometimes doesn't emit; fixed by timeout
-        timeout = yielded.getDuration() + S.character['resume_action_timeout']
-        taskMgr.doMethodLater(timeout, timeout_handler, key + '_timeout')
+        _schedule(yielded.seconds, callback)
+    elif isinstance(yielded, (LerpNodePathInterval, ActorInterval)):
+        _start()
         yielded.start()
+        end = globalClock.getFrameTime() + yielded.getDuration()
+        _intervals.append([yielded, end, char, gen, False])
+    elif isinstance(yielded, move):
+        _start()
+        def callback(end):
+            _record_latency(char, end)
+            _runner(char, gen)
+        _movement.add(char, yielded, globalClock.getFrameTime(), callback)
+    elif isinstance(yielded, decision):
+        char.request_decision(lambda value=None: _runner(char, gen, value))
+    elif isinstance(yielded, path):
+        request = yielded.request
+        def check():
+            if not request.ready():
+                _schedule(0, check)
+                return
+            _runner(char, gen, request.result)
+        _schedule(0, check)
     elif isinstance(yielded, events):
         items = yielded.items
         def callback(e_name):
@@ -70,6 +85,74 @@ def _runner(char, gen, send_value=None):
         raise Exception('Unsupported type ' + type(yielded).__name__)
 
 
+def _start():
+    """ all actions are resumed by one task """
+    global _wheel
+    if _wheel is not None:
+        return
+    _wheel = TimerWheel(TICK, start=int(globalClock.getFrameTime() / TICK))
+    def task(task):
+        now = globalClock.getFrameTime()
+        _wheel.advance_to(now)
+        _movement.update(now)
+        _check_intervals(now)
+        return task.cont
+    taskMgr.add(task, 'actions')
+
+
+def _schedule(delay, callback):
+    _start()
+    _wheel.add(delay, callback)
+
+
+def _check_intervals(now):
+    """ resumes actions in the frame when their intervals end,
+    an interval which isn't stopped yet is finished. An interval is stopped
+    until ivalLoop steps it first, so it's done only after it was seen
+    running or after its end time """
+    global _intervals
+    done = []
+    for item in _intervals:
+        stopped = item[0].isStopped()
+        if (stopped and item[4]) or now >= item[1]:
+            done.append(item)
+        elif not stopped:
+            item[4] = True
+    if not done:
+        return
+    _intervals = [item for item in _intervals if item not in done]
+    for interval, end, char, gen, running in done:
+        if not interval.isStopped():
+            interval.finish()
+        _record_latency(char, end)
+        _runner(char, gen)
+
+
+def _record_latency(char, due):
+    counts = _latencies.get(char.action)
+    if counts is None:
+        counts = _latencies[char.action] = [0] * (len(LATENCY_BINS) + 1)
+    latency = (globalClock.getFrameTime() - due) * 1000
+    counts[bisect_left(LATENCY_BINS, latency)] += 1
+
+
+def stats():
+    """ timers of pending actions, fired timers, running intervals
+    and steps of walking characters """
+    if _wheel is None:
+        return dict(pending=0, fired=0, intervals=0, steps=0)
+    return dict(pending=len(_wheel), fired=_wheel.fired,
+                intervals=len(_intervals), steps=len(_movement))
+
+
+def latency_histogram():
+    """ returns counts of resumptions of waits, intervals and steps by names
+    of actions as pairs (upper bound of latency in ms, count) """
+    bounds = LATENCY_BINS + (float('inf'),)
+    return dict((name, zip(bounds, counts))
+                for name, counts in _latencies.items())
+
+
 def _stack(gen):
     stack = []
     cur_gen = gen
@@ -112,3 +195,29 @@ class events:
 
     def __init__(self, *items):
         self.items = items
+
+
+class decision:
+    """ the action is resumed by Character.request_decision, so
+    decisions of NPCs during actions go through the scheduler. The action
+    is resumed with a value which was chosen without a decision
+    or with None """
+
+
+class path:
+    """ request has the method ready, which is checked every frame,
+    and the attribute result, the action is resumed with it """
+
+    def __init__(self, request):
+        self.request = request
+
+
+class move:
+    """ a step of the node of the character to the adjacent square pos
+    in duration seconds, the actor turns to heading at speed """
+
+    def __init__(self, pos, duration, heading, speed):
+        self.pos = pos
+        self.duration = duration
+        self.heading = heading
+        self.speed = speed
@@ -1,5 +1,6 @@
 from math import cos, sin, radians, atan2, degrees, hypot
 from direct.interval.LerpInterval import LerpPosInterval, LerpColorScaleInterval
+from map_model.occupancy import BODY
 
 
 class Body(object):
@@ -46,11 +47,18 @@ class Body(object):
         for pos in value:
             assert pos in self.manager.map
         if hasattr(self, '_poses'):
-            del self.manager.bodies[self._poses[0]]
-            del self.manager.bodies[self._poses[1]]
+            self._remove()
         self._poses = value
-        self.manager.bodies[self._poses[0]] = self
-        self.manager.bodies[self._poses[1]] = self
+        occupancy = self.manager.map.occupancy
+        for pos in value:
+            self.manager.bodies[pos] = self
+            occupancy.set(pos, BODY)
+
+    def _remove(self):
+        occupancy = self.manager.map.occupancy
+        for pos in self._poses:
+            del self.manager.bodies[pos]
+            occupancy.clear(pos, BODY)
 
     def hide(self, start=True):
         self.npc.actor.setTransparency(True)
@@ -114,8 +122,7 @@ class Body(object):
         self.show()
 
     def revive(self):
-        del self.manager.bodies[self.poses[0]]
-        del self.manager.bodies[self.poses[1]]
+        self._remove()
         pos = self.poses[0]
         npc = self.npc
         npc.pos = pos
@@ -125,5 +132,6 @@ class Body(object):
         npc.node.setH(0)
         npc.dead = False
         npc.target = npc.init_position
+        self.manager.ready.add(npc)
         self.show()
         self.lock = False
\ No newline at end of file
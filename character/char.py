@@ -1,14 +1,15 @@
 from direct.interval.LerpInterval import (
-    LerpPosInterval,
     LerpHprInterval,
     LerpColorScaleInterval
 )
 from direct.interval.ActorInterval import ActorInterval
-from character.action import action, wait, ret
+from character.action import action, wait, ret, path, move, decision
+from map_model import occupancy
 
 
 class Character(object):
     model = 'ninja'
+    occupant = occupancy.PLAYER # flag in the occupancy layer of the map
 
     #(forward, right)
     angle_table = {
@@ -25,26 +26,69 @@ class Character(object):
 
     def __init__(self, manager):
         self.action = None
-        self.action_timeouts = []
         self.must_die = False
         self.dead = False
         self.fall_forward = True
-        self.walking = False
         self.manager = manager
+        self._occupied = None
+        self.walking = False
         self.node = node = render.attachNewNode(str(id(self)))
         node.reparentTo(manager.main_node)
 
     def __nonzero__(self):
         return not self.dead
 
+    @property
+    def pos(self):
+        return self._pos
+
+    @pos.setter
+    def pos(self, value):
+        self._pos = value
+        self._occupy()
+
+    @property
+    def walking(self):
+        return self._walking
+
+    @walking.setter
+    def walking(self, value):
+        self._walking = value
+        self._occupy()
+
+    def _occupy(self):
+        """ a standing character occupies its square, a walking one
+        is accounted by Map.block """
+        pos = getattr(self, '_pos', None)
+        self._move_flag(None if self._walking else pos)
+
+    def vacate(self):
+        """ frees the square of the character until it moves again """
+        self._move_flag(None)
+
+    def _move_flag(self, pos):
+        occupancy = self.manager.map.occupancy
+        if self._occupied is not None:
+            occupancy.clear(self._occupied, self.occupant)
+        self._occupied = pos
+        if pos is not None:
+            occupancy.set(pos, self.occupant)
+
     def _start_action(self, name):
         getattr(self, 'do_' + name)()
 
+    def action_done(self):
+        """ called by the action runner when an action is finished """
+        pass
+
+    def request_decision(self, resume):
+        """ resume continues the action which yielded decision,
+        the decision is made by the action """
+        resume()
+
     def walk_pred(self, pos):
         map = self.manager.map
-        return (map.is_available(pos) and
-                'walk' in map[pos]['actions'] and
-                self.manager.is_available(pos))
+        return map.has_action(pos, 'walk') and map.occupancy.is_free(pos)
 
     @property
     def actor_angle(self):
@@ -58,11 +102,14 @@ class Character(object):
         pos = self.pos[0] + diff[0], self.pos[1] - diff[1]
         return pos
 
+    def _heading(self, to_pos):
+        shift = to_pos[1] - self.pos[1], to_pos[0] - self.pos[0]
+        return (self.angle_table[shift] + 180) % 360
+
     def _rotate_to(self, to_pos=None, angle=None, speed=None):
         assert to_pos is not None or angle is not None
         if angle is None:
-            shift = to_pos[1] - self.pos[1], to_pos[0] - self.pos[0]
-            angle = (self.angle_table[shift] + 180) % 360
+            angle = self._heading(to_pos)
         c_angle = self.actor.getHpr()[0] % 360
         d_angle = angle - c_angle
         sp = speed or self.speed
@@ -73,7 +120,6 @@ class Character(object):
             interval = LerpHprInterval(self.actor, dur, (angle, 0, 0),
                                                     (c_angle, 0, 0))
             yield interval
-            self.actor.setH(angle) # if continues by timeout
 
     @action
     def do_walk(self):
@@ -88,25 +134,31 @@ class Character(object):
         wr = S.ch_anim['walk_range']
         anim.loop(True, wr[0], wr[1])
         while True:
+            # the next step is decided unless it was kept from the last one
+            next_pos = yield decision()
             if sp != float(self.speed): # npc can change speed
                 break
-            next_pos = self.get_next_pos()
+            if next_pos is None:
+                next_pos = self.get_next_pos()
+            if isinstance(next_pos, path): # the search isn't finished
+                yield next_pos
+                continue
             if self.must_die or next_pos is None:
                 break
-            yield self._rotate_to(next_pos)
-
+            player = self is self.manager.player
+            if player: # the player can turn without a step
+                yield self._rotate_to(next_pos)
             if not map.check_square(self.pos, next_pos, self.walk_pred):
                 break
-            if self is self.manager.player and self.get_next_pos() is None:
+            if player and self.get_next_pos() is None:
                 break
             shift = next_pos[1] - self.pos[1], next_pos[0] - self.pos[0]
             dur = 1.4 / sp if all(shift) else 1.0 / sp
-            interval = LerpPosInterval(self.node, dur, next_pos + (0,))
             map.block(next_pos)
             self.walking = True
-            yield interval
+            # the actor turns while the node moves
+            yield move(next_pos, dur, self._heading(next_pos), sp)
             self.pos = next_pos
-            self.node.setPos(self.pos[0], self.pos[1], 0) # if continues by timeout
             map.unblock(self.pos)
             self.walking = False
         anim.pose(self.idle_frame)
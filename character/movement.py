@@ -0,0 +1,44 @@
+class Movement(object):
+    """ Moves nodes of walking characters between adjacent squares from
+    one per-frame update instead of intervals. A step is a linear move
+    of the node and a turn of the actor to the heading of the step at
+    the same time, the turn takes the same time as Character._rotate_to.
+    The callback of a step is called in the frame when it's finished """
+
+    def __init__(self):
+        # character -> (start, step, start time, start angle, turn, callback)
+        self.steps = {}
+        self.finished = 0
+
+    def __len__(self):
+        return len(self.steps)
+
+    def add(self, char, step, now, callback):
+        assert char not in self.steps, char
+        start = char.node.getPos()
+        start = start[0], start[1]
+        angle = char.actor.getHpr()[0] % 360
+        turn = step.heading - angle
+        if abs(turn) > 180:
+            turn = turn - 360 if turn > 0 else turn + 360
+        self.steps[char] = start, step, now, angle, turn, callback
+
+    def update(self, now):
+        finished = []
+        for char, (start, step, start_time, angle, turn,
+                   callback) in self.steps.items():
+            elapsed = now - start_time
+            part = min(1.0, elapsed / step.duration)
+            char.node.setPos(start[0] + (step.pos[0] - start[0]) * part,
+                             start[1] + (step.pos[1] - start[1]) * part, 0)
+            if turn:
+                turn_duration = float(abs(turn)) / 360 / step.speed * 2
+                turn_part = min(1.0, elapsed / turn_duration)
+                char.actor.setH(angle + turn * turn_part)
+            if part == 1:
+                finished.append((start_time + step.duration, char, callback))
+        finished.sort() # in order of ends
+        for end, char, callback in finished:
+            del self.steps[char]
+            self.finished += 1
+            callback(end)
@@ -7,12 +7,17 @@ from direct.actor.Actor import Actor
 
 from character.char import Character
 from character.player import Player
-from character.action import action, wait
+from character.action import action, wait, path
 from character.body import Body
+from map_model.dstar import DStarLite
+from map_model.pathpool import PoolRequest, STALE
+from map_model import occupancy
 
 
 class NPC(Character):
 
+    occupant = occupancy.NPC
+
     def __init__(self, manager, texture, route, alert_texture=None, **spam):
         super(NPC, self).__init__(manager)
 
@@ -25,6 +30,11 @@ class NPC(Character):
         self.post_hit_range = S.npc_anim['post_hit_range']
         self.post_hit_speed = S.npc_anim['post_hit_speed']
         self.alert_texture = alert_texture
+        self.planner = None
+        self.pending_decision = None # resumes the walk, see update_action
+        self.path_request = None # PoolRequest
+        self.pool_path = None # (goal, squares from the start)
+        self.lod_tier = 0 # full fidelity, see Manager.update_lod
 
         self.actor = actor = Actor(S.model(self.model),
                                     {'anim': S.model(self.model)})
@@ -55,8 +65,9 @@ class NPC(Character):
             old_pos in self.manager.npcs and
             self.manager.npcs[old_pos] is self):
             del self.manager.npcs[old_pos]
-        self._pos = value
+        Character.pos.fset(self, value)
         self.manager.npcs[self._pos] = self
+        self.manager.npc_index.update(self, value)
 
     @property
     def target(self):
@@ -68,36 +79,99 @@ class NPC(Character):
         self._target = value
 
     def path_pred(self, pos):
-        manager = self.manager
-        map = manager.map
-        return ('walk' in map[pos]['actions'] and
-                map.is_available(pos) and
-                (pos not in manager.npcs or
-                manager.npcs[pos].walking))
+        map = self.manager.map
+        return (map.has_action(pos, 'walk') and
+                map.occupancy.is_free(pos, occupancy.BLOCKED | occupancy.NPC))
 
     def get_next_pos(self):
         if self.get_action() != 'walk':
             return
         manager = self.manager
-        map = manager.map
         target = self.target
         if isinstance(target, Body):
-            path1 = map.get_path(self.pos, target.poses[0], self.path_pred)
-            path2 = map.get_path(self.pos, target.poses[1], self.path_pred)
-            if not path1 and not path2:
-                return
-
-            length1 = len(path1) if path1 else float('inf')
-            length2 = len(path2) if path2 else float('inf')
-            if length1 < length2:
-                return path1[0]
-            return path2[0]
+            goals = target.poses
         else:
-            end_pos = target if isinstance(target, tuple) else target.pos
-            path = map.get_path(self.pos, end_pos, self.path_pred)
-            if not path:
-                return
-            return path[0]
+            if target is manager.player:
+                field = manager.get_player_field()
+                next_pos = field.next_step(self.pos, self.path_pred)
+                if next_pos is not None:
+                    return next_pos
+            if target == self.route[0]:
+                next_pos = self.route_step()
+                if next_pos is not None:
+                    if manager.map.check_square(self.pos, next_pos,
+                                                self.walk_pred):
+                        return next_pos
+                    if self.lod_tier:
+                        return # far NPCs wait instead of a detour
+            if target in manager.map.goal_fields:
+                field = manager.map.goal_field(target)
+                next_pos = field.next_step(self.pos, self.path_pred)
+                if next_pos is not None:
+                    return next_pos
+            goals = (target if isinstance(target, tuple) else target.pos,)
+            hierarchy = manager.map.hierarchy
+            if hierarchy is not None and hierarchy.is_far(self.pos, goals[0]):
+                path = manager.map.get_path_prefix(self.pos, goals[0],
+                                                   self.path_pred)
+                return path[0] if path else None
+        goals = tuple(g for g in goals
+                      if manager.map.is_reachable(self.pos, g))
+        if not goals:
+            return
+        if manager.path_pool is not None and len(goals) == 1:
+            return self.pool_step(goals[0])
+        planner = self.planner
+        if planner is None or planner.map is not manager.map:
+            planner = self.planner = DStarLite(manager.map, self.path_pred)
+        return planner.next_step(self.pos, goals,
+                                 manager.map.occupancy.items())
+
+    def pool_step(self, goal):
+        """ follows the path from the path pool of the manager. While
+        a new path is searched, the request is returned for do_walk """
+        pool = self.manager.path_pool
+        if self.pool_path is not None:
+            path_goal, squares = self.pool_path
+            if path_goal == goal and self.pos in squares[:-1]:
+                next_pos = squares[squares.index(self.pos) + 1]
+                if self.manager.map.check_square(self.pos, next_pos,
+                                                 self.walk_pred):
+                    return next_pos
+            self.pool_path = None
+        request = self.path_request
+        if request is not None and (request.start, request.end) != (self.pos,
+                                                                    goal):
+            request.cancel()
+            request = None
+        if request is None or request.result is STALE:
+            request = self.path_request = PoolRequest(pool, self.pos, goal)
+        if not request.ready():
+            return path(request)
+        if request.result is STALE:
+            return self.pool_step(goal)
+        self.path_request = None
+        if request.result.path is None:
+            return
+        self.pool_path = goal, (self.pos,) + request.result.path
+        return self.pool_step(goal)
+
+    def route_step(self):
+        """ returns the next square of the precomputed leg of the route or
+        None if the NPC is off the leg, then the NPC searches a path """
+        route = self.route
+        leg = self.manager.map.route_leg(route[-1], route[0])
+        if leg is None or self.pos == route[0]:
+            return
+        try:
+            return leg[leg.index(self.pos) + 1]
+        except ValueError:
+            return
+
+    @property
+    def alerted(self):
+        return (self.must_die or not isinstance(self.target, tuple) or
+                self.speed != S.npc['speed'])
 
     def get_action(self):
         player = self.manager.player
@@ -130,7 +204,35 @@ class NPC(Character):
             return 'revive'
         return 'walk'
 
+    def action_done(self):
+        self.manager.action_done(self)
+
+    def request_decision(self, resume):
+        self.pending_decision = resume
+        self.manager.ready.add(self)
+
+    def keep_walking(self):
+        """ continues the walk by the leg of the route without a decision,
+        far NPCs do it between frames of their decisions (see
+        Manager.update_lod). An NPC off the leg waits for the decision """
+        if self.alerted or self.target != self.route[0]:
+            return
+        next_pos = self.route_step()
+        if (next_pos is None or not
+            self.manager.map.check_square(self.pos, next_pos,
+                                          self.walk_pred)):
+            return
+        resume = self.pending_decision
+        self.pending_decision = None
+        self.manager.ready.discard(self)
+        resume(next_pos)
+
     def update_action(self):
+        resume = self.pending_decision
+        if resume is not None:
+            self.pending_decision = None
+            resume()
+            return
         if self.action is not None:
             return
         action = self.get_action()
@@ -139,34 +241,42 @@ class NPC(Character):
             return
         self._start_action(action)
 
+    @property
+    def observer(self):
+        return self.pos, self.actor_angle, self.view_angle, self.view_radius
+
+    def can_see(self, pos):
+        """ uses the result of the perception stage of the manager
+        if the NPC hasn't moved or turned since it """
+        observer = self.observer
+        perceived = self.manager.perception.get(self)
+        if (perceived is not None and perceived[0] == observer and
+            pos in perceived[1]):
+            return pos in perceived[2]
+        return self.manager.map.can_see(*(observer + (pos,)))
+
     def in_view_field(self, char):
         assert isinstance(char, Character)
         if isinstance(char, Player) and S.invisible_player:
             return None
         map = self.manager.map
-        radius, c_angle = self.view_radius, self.view_angle
-        pred = lambda pos: 'see' in map[pos]['actions']
-        field = map.view_field(self.pos, self.actor_angle,
-                                    c_angle, radius, pred)
-        if char.pos in field:
-            path = map.get_path(self.pos, char.pos, self.path_pred)
+        if self.can_see(char.pos):
+            path = map.get_path(self.pos, char.pos, self.path_pred,
+                                walk_pred=True)
             if path is None:
                 return None
             return len(path)
 
     def get_nearest_body(self):
         map = self.manager.map
-        radius, c_angle = self.view_radius, self.view_angle
-        pred = lambda pos: 'see' in map[pos]['actions']
-        field = map.view_field(self.pos, self.actor_angle,
-                                    c_angle, radius, pred)
-        bodies = [(pos, b) for pos, b in self.manager.bodies.items()
-                                                    if pos in field]
-        if not bodies:
+        bodies = self.manager.bodies
+        poses = [pos for pos in bodies if self.can_see(pos)]
+        found = map.get_path_multi(self.pos, poses, self.path_pred,
+                                   walk_pred=True)
+        if found is None:
             return None, None
-        lengths = [(len(map.get_path(self.pos, pos, self.path_pred)), b)
-                   for pos, b in bodies]
-        return min(lengths, key=lambda v: v[0])
+        pos, path, length = found
+        return len(path), bodies[pos]
 
     @property
     def face_to_player(self):
@@ -218,6 +328,16 @@ class TargetNPC(NPC):
 
     path_pred = Character.walk_pred
 
+    @property
+    def pos(self):
+        return self._pos
+
+    @pos.setter
+    def pos(self, value):
+        NPC.pos.fset(self, value)
+        if self and value == self.manager.map.escape_position:
+            self.manager.finish(False)
+
     def get_action(self):
         player = self.manager.player
         if player and self.in_view_field(player):
@@ -56,7 +56,7 @@ class Player(Character):
     def pos(self, value):
         assert value in self.manager.map
         prev_pos = getattr(self, '_pos', None)
-        self._pos = value
+        Character.pos.fset(self, value)
         self.manager.on_player_moved(prev_pos, value)
 
     def set_camera(self):
@@ -230,7 +230,7 @@ class Player(Character):
     @action
     def do_jump(self):
         map = self.manager.map
-        pred = lambda pos: 'jump' in map[pos]['actions']
+        pred = lambda pos: map.has_action(pos, 'jump')
         field = deque(map.get_jump_field(self.pos))
         if not field:
             return
@@ -0,0 +1,50 @@
+from time import time
+
+
+class Scheduler(object):
+    """ Spreads decisions of idle NPCs and of walking NPCs between steps
+    over frames. Decisions are made in order of priority until the budget
+    (in milliseconds) is spent, at least one decision is made per frame.
+    Other NPCs are deferred and keep their current state, an NPC which was
+    deferred max_delay frames goes before all others """
+
+    def __init__(self, budget, max_delay, clock=time):
+        self.budget = budget
+        self.max_delay = max_delay
+        self.clock = clock
+        self.delays = {}
+        self.queue_length = 0 # NPCs deferred in the last frame
+        self.overruns = 0 # frames which exceeded the budget
+        self.decisions = 0
+
+    def run(self, npcs, priority):
+        """ npcs are NPCs which wait for a decision, priority is a function
+        which returns a sorting key (lower goes first) """
+        delays = self.delays
+        max_delay = self.max_delay
+        queue = sorted(npcs, key=lambda npc: (
+            delays.get(npc, 0) < max_delay, priority(npc)))
+        budget = self.budget / 1000.0
+        start = self.clock()
+        done = 0
+        for npc in queue:
+            if done and self.clock() - start >= budget:
+                break
+            npc.update_action()
+            delays.pop(npc, None)
+            done += 1
+        if self.clock() - start > budget:
+            self.overruns += 1
+        self.decisions += done
+        deferred = queue[done:]
+        self.queue_length = len(deferred)
+        for npc in deferred:
+            delays[npc] = delays.get(npc, 0) + 1
+        queued = set(queue)
+        for npc in tuple(delays):
+            if npc not in queued:
+                del delays[npc]
+
+    def stats(self):
+        return dict(queue_length=self.queue_length, overruns=self.overruns,
+                    decisions=self.decisions)
@@ -0,0 +1,57 @@
+from math import ceil
+from itertools import count
+
+EPSILON = 1e-6 # delays of whole ticks aren't rounded up by float errors
+
+
+class TimerWheel(object):
+    """ Hashed timer wheel. Time is divided into ticks of resolution
+    seconds, a timer is put into the slot of its due tick modulo
+    the number of slots with the count of full revolutions before it.
+    advance_to visits only slots of elapsed ticks """
+
+    def __init__(self, resolution, slots=256, start=0):
+        self.resolution = resolution
+        self.slots = [{} for _ in range(slots)] # id -> [rounds, callback]
+        self.tick = start
+        self.timers = {} # id -> index of the slot
+        self._ids = count(1)
+        self.fired = 0
+
+    def __len__(self):
+        return len(self.timers)
+
+    def add(self, delay, callback):
+        """ callback is called without arguments after delay seconds,
+        at the next tick at the earliest. Returns the id of the timer """
+        ticks = max(1, int(ceil(delay / self.resolution - EPSILON)))
+        index = (self.tick + ticks) % len(self.slots)
+        timer_id = next(self._ids)
+        self.slots[index][timer_id] = [(ticks - 1) // len(self.slots),
+                                       callback]
+        self.timers[timer_id] = index
+        return timer_id
+
+    def cancel(self, timer_id):
+        index = self.timers.pop(timer_id, None)
+        if index is not None:
+            del self.slots[index][timer_id]
+
+    def advance_to(self, seconds):
+        for _ in range(int(seconds / self.resolution + EPSILON) - self.tick):
+            self.tick += 1
+            slot = self.slots[self.tick % len(self.slots)]
+            due = []
+            for timer_id, timer in slot.items():
+                if timer[0]:
+                    timer[0] -= 1
+                else:
+                    due.append(timer_id)
+            due.sort() # in order of adding
+            for timer_id in due:
+                if timer_id not in self.timers: # cancelled by a callback
+                    continue
+                del self.timers[timer_id]
+                callback = slot.pop(timer_id)[1]
+                self.fired += 1
+                callback()
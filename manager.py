@@ -5,9 +5,15 @@ from collections import defaultdict, deque
 from panda3d.core import *
 
 from map_model.map import Map
+from map_model.field import DistanceField
+from map_model.perception import batch_can_see
+from map_model.occupancy import BLOCKED, NPC as NPC_FLAG, PLAYER, BODY
+from map_model.spatial import SpatialHash
+from map_model.pathpool import PathPool
 from map_builder import MapBuilder
 from character.player import Player
 from character.npc import NPC, TargetNPC
+from character.scheduler import Scheduler
 from character.body import Body
 
 
@@ -15,14 +21,32 @@ class Manager(object):
 
     def __init__(self, map_name):
         self.main_node = render.attachNewNode('main_node')
-        self.blocked_squares = set()
         self.bodies = {}
-        self.map = Map(map_name)
+        self._player_field = None
+        self.perception = {}
+        # positions of NPCs, they are maintained by NPC.pos
+        self.npc_index = SpatialHash(S.npc['alert_radius'])
+        # origins and targets of alerts of the current tick
+        self.alerts = set()
+        self.scheduler = Scheduler(S.ai['budget'], S.ai['max_delay'])
+        self.frame = 0
+        self.finished = False
+        # living NPCs without an action, they wait for a decision
+        self.ready = set()
+        self.map = Map(map_name,
+                       path_algorithm=S.pathfinding['algorithm'],
+                       dense=S.pathfinding['dense_map'],
+                       cluster_size=S.pathfinding['cluster_size'],
+                       fov_algorithm=S.view_field['algorithm'],
+                       view_cache_size=S.view_field['cache_size'])
+        workers = S.pathfinding['workers']
+        self.path_pool = PathPool(self.map, workers) if workers else None
         self.map_builder = MapBuilder(self.map, self.main_node)
         self.map_builder.build()
         self.map_builder.clear_map_textures()
         self.player = Player(self, self.map.start_pos)
         self.set_npcs()
+        self.ready.update(self.npcs.values())
         self.setup_graphics()
 
         if S.show_view_field:
@@ -53,26 +77,120 @@ class Manager(object):
         TargetNPC(self, **data)
 
     def is_available(self, pos):
+        """ True if no standing character or body is on the square """
         return (pos in self.map and
-                (pos != self.player.pos or self.player.walking) and
-                (pos not in self.npcs or self.npcs[pos].walking) and
-                pos not in self.bodies)
+                self.map.occupancy.is_free(pos, NPC_FLAG | PLAYER | BODY))
+
+    def occupied_squares(self):
+        """ squares which can be not free because of characters,
+        the frozenset is cached until the occupancy is changed """
+        return self.map.occupancy.squares()
+
+    def planner_stats(self):
+        """ total counters of incremental planners of NPCs """
+        stats = dict(full_searches=0, repairs=0, expanded=0)
+        for npc in self.npcs.values():
+            if npc.planner is None:
+                continue
+            for key in stats:
+                stats[key] += getattr(npc.planner, key)
+        return stats
+
+    def get_player_field(self):
+        """ The distance field to the player shared by all chasing NPCs.
+        It is built over static walkability, so it is rebuilt only when the
+        player changes a square; moving characters are avoided by
+        DistanceField.next_step """
+        pos = self.player.pos
+        field = self._player_field
+        if field is None or field.goal != pos or field.map is not self.map:
+            map = self.map
+            pred = lambda pos: map.has_action(pos, 'walk')
+            field = self._player_field = DistanceField(map, pos, pred)
+        return field
 
     def __call__(self, task):
+        self.frame += 1
+        self.alerts.clear()
+        if self.path_pool is not None:
+            self.path_pool.sync()
         self.player.update_action()
-        for npc in tuple(self.npcs.values()):
-            if not npc and npc.action is None:
-                if isinstance(npc, TargetNPC):
-                    self.finish(True)
-                del self.npcs[npc.pos]
-                Body(npc, self)
-                continue
-            npc.update_action()
-            if isinstance(npc, TargetNPC) and npc.pos == self.map.escape_position:
-                self.finish(False)
+        # the ready set has idle NPCs, they are returned by action_done,
+        # and walking NPCs between steps (NPC.request_decision)
+        self.update_lod(self.ready)
+        tiers = S.npc['lod_tiers']
+        ready = []
+        for npc in list(self.ready):
+            if not (self.frame + hash(npc)) % tiers[npc.lod_tier][1]:
+                ready.append(npc)
+            elif npc.pending_decision is not None:
+                npc.keep_walking()
+        self.update_perception(ready)
+        self.scheduler.run(ready, self.decision_priority)
+        self.ready.difference_update(
+            npc for npc in ready
+            if npc.action is not None and npc.pending_decision is None)
         return task.cont
 
+    def action_done(self, npc):
+        """ A dead NPC becomes a body, a living one waits for a decision.
+        The escape of the target NPC is checked by TargetNPC.pos """
+        if not npc:
+            if isinstance(npc, TargetNPC):
+                self.finish(True)
+            del self.npcs[npc.pos]
+            self.npc_index.remove(npc)
+            npc.vacate()
+            Body(npc, self)
+            return
+        self.ready.add(npc)
+
+    def decision_priority(self, npc):
+        """ dying and alerted NPCs go first, then NPCs near the player """
+        pos, player_pos = npc.pos, self.player.pos
+        return not npc.alerted, hypot(pos[0] - player_pos[0],
+                                      pos[1] - player_pos[1])
+
+    def update_lod(self, npcs):
+        """ Sets tiers of AI level of detail by the distance to the player,
+        alerted NPCs always have full fidelity (the tier 0). It's called
+        for NPCs which wait for a decision, a tier decides how often they
+        are decided """
+        tiers = S.npc['lod_tiers']
+        player_pos = self.player.pos
+        for npc in npcs:
+            tier = 0
+            if not npc.alerted:
+                dist = hypot(npc.pos[0] - player_pos[0],
+                             npc.pos[1] - player_pos[1])
+                while tier < len(tiers) - 1 and dist > tiers[tier][0]:
+                    tier += 1
+            npc.lod_tier = tier
+
+    def update_perception(self, npcs):
+        """ Evaluates at once which of the player and bodies the NPCs can
+        see. It's called for NPCs which are decided in this tick, walking
+        NPCs are between steps, so results are for their current squares
+        and headings. NPC.can_see reads the results while they are up to
+        date, far NPCs (see update_lod) aren't evaluated """
+        npcs = [npc for npc in npcs if npc and not npc.lod_tier]
+        targets = [self.player.pos] + sorted(self.bodies)
+        observers = [npc.observer for npc in npcs]
+        seen = batch_can_see(self.map, observers, targets)
+        targets = frozenset(targets)
+        self.perception = dict((npc, (observer, targets, visible))
+                               for npc, observer, visible
+                               in zip(npcs, observers, seen))
+
     def finish(self, win):
+        """ the game is over once, actions which are still running can't
+        finish it again """
+        if self.finished:
+            return
+        self.finished = True
+        if self.path_pool is not None:
+            self.path_pool.close()
+            self.path_pool = None
         base.finish_game(win)
 
     def on_player_moved(self, prev_pos, pos):
@@ -102,21 +220,29 @@ class Manager(object):
             model.setAlphaScale(S.graphics['transparency'])
 
     def alert(self, pos, target=None):
-        for npc in self.npcs.values():
+        """ sets the target for NPCs within alert_radius around pos,
+        the same alert is processed once per tick """
+        target = target or self.player
+        if (pos, target) in self.alerts:
+            return
+        self.alerts.add((pos, target))
+        poses = target.poses if isinstance(target, Body) else (target.pos,)
+        for npc in self.npc_index.query_radius(pos, S.npc['alert_radius']):
             if not npc:
                 continue
-            length = hypot(npc.pos[0] - pos[0], npc.pos[1] - pos[1])
-            if length <= S.npc['alert_radius']:
-                if isinstance(npc, TargetNPC):
-                    npc.target = self.map.escape_position
-                    npc.speed = S.target_npc['escape_speed']
-                else:
-                    npc.set_alert_texture()
-                    #FIXME: don't set target if path to it doesn't exist
-                    npc.target = target or self.player
-                    npc.speed = S.npc['excited_speed']
-                    npc.view_radius = S.npc['excited_view_radius']
-                    npc.view_angle = S.npc['excited_view_angle']
+            if isinstance(npc, TargetNPC):
+                npc.lod_tier = 0
+                npc.target = self.map.escape_position
+                npc.speed = S.target_npc['escape_speed']
+            else:
+                if not any(self.map.is_reachable(npc.pos, p) for p in poses):
+                    continue
+                npc.set_alert_texture()
+                npc.lod_tier = 0
+                npc.target = target
+                npc.speed = S.npc['excited_speed']
+                npc.view_radius = S.npc['excited_view_radius']
+                npc.view_angle = S.npc['excited_view_angle']
 
     def setup_graphics(self):
         angle = self.map.hour * 15 - 90
@@ -157,9 +283,7 @@ class Manager(object):
             del self.view_fields[key]
             radius, c_angle = npc.view_radius, npc.view_angle
             angle = int(npc.actor.getHpr()[0] - 90) % 360
-            pred = lambda pos: 'see' in self.map[pos]['actions']
-            field = self.map.view_field(npc.pos, angle,
-                                        c_angle, radius, pred)
+            field = self.map.sight_field(npc.pos, angle, c_angle, radius)
             for pos in field:
                 marker = loader.loadModel(S.model('plane'))
                 marker.setHpr(0, -90, 0)
@@ -179,12 +303,10 @@ class Manager(object):
             del self.pathes[key]
             target = npc.target
             end_pos = target if isinstance(target, tuple) else target.pos
-            pred = lambda pos: ('walk' in map[pos]['actions'] and
-                                map.is_available(pos) and
-                                (pos not in self.npcs or
-                                self.npcs[pos].walking) and
-                                pos not in self.bodies)
-            path = map.get_path(npc.pos, end_pos, pred)
+            pred = lambda pos: (map.has_action(pos, 'walk') and
+                                map.occupancy.is_free(
+                                    pos, BLOCKED | NPC_FLAG | BODY))
+            path = map.get_path(npc.pos, end_pos, pred, walk_pred=True)
             if path is None:
                 continue
 
@@ -138,6 +138,7 @@ def kind_widget(edit_panel):
             if info.get('default', False):
                 continue
             group[fname] = info['type']()
+        edit_panel.editor.map.definition_changed()
         edit_panel.set_group_by_kind()
 
     return DirectOptionMenu(highlightColor=(0.6, 0.6, 0.6, 1),
@@ -240,6 +241,7 @@ def action_widget(edit_panel, fname, action):
             actions.append(action)
         else:
             actions.remove(action)
+        edit_panel.editor.map.definition_changed()
 
     return DirectCheckButton(command=set_value,
                              text=action,
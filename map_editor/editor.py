@@ -25,7 +25,8 @@ class Editor(ShowBase):
         self.stop_loop = False
         self.current_group = None
         self._group_markers = set()
-        self.map = Map(map_name)
+        self.map = Map(map_name,
+                       cluster_size=S.pathfinding['cluster_size'])
         self.map_builder = MapBuilder(self.map, render)
         self.map_builder.build()
         self.edit_panel = EditPanel(self)
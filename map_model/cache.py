@@ -0,0 +1,35 @@
+from collections import OrderedDict
+
+
+class LRUCache(object):
+    """ Bounded mapping which drops the least recently used items.
+    Counts hits and misses of get """
+
+    def __init__(self, max_size):
+        assert max_size > 0, max_size
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._items = OrderedDict()
+
+    def get(self, key, default=None):
+        try:
+            value = self._items.pop(key)
+        except KeyError:
+            self.misses += 1
+            return default
+        self.hits += 1
+        self._items[key] = value
+        return value
+
+    def __setitem__(self, key, value):
+        self._items.pop(key, None)
+        self._items[key] = value
+        if len(self._items) > self.max_size:
+            self._items.popitem(last=False)
+
+    def __len__(self):
+        return len(self._items)
+
+    def clear(self):
+        self._items.clear()
@@ -0,0 +1,181 @@
+from math import sqrt
+from heapq import heappush, heappop
+from map_model.jps import octile
+
+SQRT2 = sqrt(2)
+INF = float('inf')
+
+
+class DStarLite(object):
+    """ Incremental planner (D* Lite) with the rules of Map.get_path.
+    The search goes from goals to the start, so the state stays valid
+    while the start moves. Only squares whose occupancy flags changed
+    since the previous call are repaired; a change of goals causes
+    a full search """
+
+    def __init__(self, map, pred):
+        self.map = map
+        self.pred = pred
+        self.goals = None
+        self.start = None
+        self.full_searches = 0
+        self.repairs = 0
+        self.expanded = 0
+
+    def _reset(self, start, goals, occupied):
+        self.full_searches += 1
+        self.goals = goals
+        self.start = start
+        self._occupied = occupied
+        self._km = 0
+        self._g = {}
+        self._rhs = {}
+        self._free = {}
+        self._open = []
+        self._keys = {}
+        for goal in goals:
+            self._rhs[goal] = 0
+            self._push(goal)
+
+    def free(self, pos):
+        if pos == self.start:
+            return True
+        try:
+            return self._free[pos]
+        except KeyError:
+            value = pos in self.map and bool(self.pred(pos))
+            self._free[pos] = value
+            return value
+
+    def cost(self, first, second):
+        free = self.free
+        if not (free(first) and free(second)):
+            return INF
+        if first[0] != second[0] and first[1] != second[1]:
+            if not (free((first[0], second[1])) and
+                    free((second[0], first[1]))):
+                return INF
+            return SQRT2
+        return 1
+
+    def _neighbors(self, pos):
+        return [n for n, info in self.map.neighbors(pos, True)]
+
+    def _key(self, pos):
+        value = min(self._g.get(pos, INF), self._rhs.get(pos, INF))
+        # rounding hides the error of float sums, otherwise equal keys
+        # can stop the search too early
+        return round(value + octile(self.start, pos) + self._km, 9), value
+
+    def _push(self, pos):
+        key = self._keys[pos] = self._key(pos)
+        heappush(self._open, (key, pos))
+
+    def _top(self):
+        open_lst, keys = self._open, self._keys
+        while open_lst:
+            key, pos = open_lst[0]
+            if keys.get(pos) == key:
+                return key, pos
+            heappop(open_lst)
+        return (INF, INF), None
+
+    def _update_vertex(self, pos):
+        if pos not in self.goals:
+            best = INF
+            g = self._g
+            for n in self._neighbors(pos):
+                best = min(best, self.cost(pos, n) + g.get(n, INF))
+            self._rhs[pos] = best
+        if self._g.get(pos, INF) != self._rhs.get(pos, INF):
+            self._push(pos)
+        else:
+            self._keys.pop(pos, None)
+
+    def _compute(self):
+        g, rhs, keys = self._g, self._rhs, self._keys
+        start = self.start
+        while True:
+            top_key, u = self._top()
+            if u is None:
+                return
+            if (top_key >= self._key(start) and
+                rhs.get(start, INF) == g.get(start, INF)):
+                return
+            self.expanded += 1
+            new_key = self._key(u)
+            if top_key < new_key:
+                self._push(u)
+            elif g.get(u, INF) > rhs.get(u, INF):
+                g[u] = rhs[u]
+                del keys[u]
+                for n in self._neighbors(u):
+                    if n not in self.goals:
+                        value = self.cost(n, u) + g[u]
+                        if value < rhs.get(n, INF):
+                            rhs[n] = value
+                            self._update_vertex_key(n)
+            else:
+                g[u] = INF
+                for n in self._neighbors(u) + [u]:
+                    self._update_vertex(n)
+
+    def _update_vertex_key(self, pos):
+        if self._g.get(pos, INF) != self._rhs.get(pos, INF):
+            self._push(pos)
+        else:
+            self._keys.pop(pos, None)
+
+    def _repair(self, start, occupied):
+        self.repairs += 1
+        if occupied is self._occupied:
+            changed = ()
+        else:
+            changed = set(pos for pos, flags in self._occupied ^ occupied)
+        self._occupied = occupied
+        to_update = set()
+        if start != self.start:
+            # the free state of both squares is overridden by the start
+            for pos in start, self.start:
+                self._free.pop(pos, None)
+                to_update.add(pos)
+                to_update.update(self._neighbors(pos))
+            self._km += octile(self.start, start)
+            self.start = start
+        for pos in changed:
+            if pos not in self._free:
+                continue
+            old = self._free.pop(pos)
+            if self.free(pos) != old:
+                to_update.add(pos)
+                to_update.update(self._neighbors(pos))
+        for pos in to_update:
+            self._update_vertex(pos)
+
+    def next_step(self, start, goals, occupied):
+        """ returns the first step of a shortest path from start to
+        the nearest goal or None. occupied are pairs of squares which can be
+        not free because of characters and their flags; they are compared
+        with the previous ones to find squares for repairing, so a square
+        which stays occupied with other flags is repaired too. The same
+        frozenset (see Occupancy.items) is not compared """
+        goals = tuple(goals)
+        occupied = frozenset(occupied)
+        if goals != self.goals:
+            self._reset(start, goals, occupied)
+        else:
+            self._repair(start, occupied)
+        self._compute()
+        if start in goals or self._rhs.get(start, INF) == INF:
+            return
+        best_key, best_pos = None, None
+        for n in self._neighbors(start):
+            step = self.cost(start, n)
+            value = step + self._g.get(n, INF)
+            if value == INF:
+                continue
+            # a diagonal step is preferred like in Map.get_path
+            key = round(value, 9), -step
+            if best_key is None or key < best_key:
+                best_key, best_pos = key, n
+        return best_pos
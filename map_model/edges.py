@@ -0,0 +1,127 @@
+from collections import defaultdict
+
+# sides of a square in doubled coordinates, so all vertices are integers:
+# (axis of the side line, offset of the line, offset of the neighbor)
+SIDES = (
+    (1, 1, (0, 1)),
+    (1, -1, (0, -1)),
+    (0, 1, (1, 0)),
+    (0, -1, (-1, 0)),
+)
+
+
+class ObstacleEdges(object):
+    """ Outline of a set of obstacle squares for line of sight tests.
+    Only sides between an obstacle and a free square are kept and collinear
+    adjacent sides are fused into long edges, so a segment between centers
+    of free squares touches an obstacle if and only if it touches an edge.
+    Edges are indexed by buckets of bucket_size squares """
+
+    def __init__(self, obstacles, bucket_size=4):
+        assert bucket_size > 0, bucket_size
+        self.bucket_size = bucket_size
+        self.obstacles = obstacles
+        self.tests = 0 # segment tests, for benchmarking
+        # edges are (axis, line, low, high), the line is x = line / 2
+        # for axis 0 and y = line / 2 for axis 1
+        lines = defaultdict(list)
+        for x, y in obstacles:
+            for axis, offset, (dx, dy) in SIDES:
+                if (x + dx, y + dy) in obstacles:
+                    continue
+                center = (2 * x, 2 * y)
+                lines[axis, center[axis] + offset].append(
+                    center[1 - axis] - 1)
+        self.edges = []
+        for (axis, line), lows in lines.items():
+            lows.sort()
+            low = high = None
+            for side_low in lows:
+                if high is not None and side_low <= high:
+                    high = max(high, side_low + 2)
+                    continue
+                if high is not None:
+                    self.edges.append((axis, line, low, high))
+                low, high = side_low, side_low + 2
+            self.edges.append((axis, line, low, high))
+        self.buckets = defaultdict(list)
+        for edge in self.edges:
+            for key in self._bucket_keys(*self._bounds(edge)):
+                self.buckets[key].append(edge)
+
+    def _bounds(self, edge):
+        """ bounding box of an edge in doubled coordinates """
+        axis, line, low, high = edge
+        if axis == 0:
+            return (line, low), (line, high)
+        return (low, line), (high, line)
+
+    def _bucket_keys(self, first, second):
+        size = 2 * self.bucket_size
+        for bx in range(min(first[0], second[0]) // size,
+                        max(first[0], second[0]) // size + 1):
+            for by in range(min(first[1], second[1]) // size,
+                            max(first[1], second[1]) // size + 1):
+                yield bx, by
+
+    def crosses(self, start, end, pred=None):
+        """ True if the segment between centers of the squares touches
+        an obstacle which satisfies pred (any obstacle if pred is None).
+        Only edges from buckets of the bounding box of the segment
+        are tested """
+        start = 2 * start[0], 2 * start[1]
+        end = 2 * end[0], 2 * end[1]
+        min_x, max_x = min(start[0], end[0]), max(start[0], end[0])
+        min_y, max_y = min(start[1], end[1]), max(start[1], end[1])
+        tested = set()
+        for key in self._bucket_keys(start, end):
+            for edge in self.buckets.get(key, ()):
+                if edge in tested:
+                    continue
+                tested.add(edge)
+                axis, line, low, high = edge
+                if axis == 0:
+                    if not (min_x <= line <= max_x and
+                            low <= max_y and min_y <= high):
+                        continue
+                elif not (min_y <= line <= max_y and
+                          low <= max_x and min_x <= high):
+                    continue
+                touched = self._touched(start, end, edge)
+                if touched and (pred is None or any(pred(sq)
+                                                    for sq in touched)):
+                    return True
+        return False
+
+    def _touched(self, start, end, edge):
+        """ obstacles touched by the segment at the edge, the test is exact
+        in integers. Parallel segments never touch as in segment_crossing """
+        self.tests += 1
+        axis, line, low, high = edge
+        other = 1 - axis
+        diff = end[axis] - start[axis]
+        if diff == 0:
+            return ()
+        if not min(start[axis], end[axis]) <= line <= max(start[axis],
+                                                          end[axis]):
+            return ()
+        # coordinate of the crossing along the edge multiplied by diff
+        cross = (start[other] * diff +
+                 (line - start[axis]) * (end[other] - start[other]))
+        if diff < 0:
+            cross, diff = -cross, -diff
+        if not low * diff <= cross <= high * diff:
+            return ()
+        # squares are [2 * k - 1, 2 * k + 1] along both axes, the crossing
+        # is a corner of two squares if it's an odd integer
+        if cross % diff == 0 and cross // diff % 2:
+            along = (cross // diff - 1) // 2, (cross // diff + 1) // 2
+        else:
+            along = ((cross + diff) // (2 * diff),)
+        touched = []
+        for k in along:
+            for j in (line - 1) // 2, (line + 1) // 2:
+                sq = (j, k) if axis == 0 else (k, j)
+                if sq in self.obstacles:
+                    touched.append(sq)
+        return touched
@@ -0,0 +1,80 @@
+from math import sqrt
+from heapq import heappush, heappop
+
+SQRT2 = sqrt(2)
+
+
+class DistanceField(object):
+    """ Lengths of shortest paths from every reachable square to the goal.
+    It is a reverse Dijkstra search with the rules of Map.get_path,
+    so a step along the field is the first step of a shortest path """
+
+    def __init__(self, map, goal, pred):
+        self.map = map
+        self.goal = goal
+        self.distances = {}
+        if goal in map and pred(goal):
+            self._build(pred)
+
+    def _build(self, pred):
+        map = self.map
+        distances = self.distances
+        free = {}
+        def is_free(pos):
+            if pos not in free:
+                free[pos] = pred(pos)
+            return free[pos]
+
+        distances[self.goal] = 0
+        open_lst = [(0, self.goal)]
+        closed = set()
+        while open_lst:
+            dist, sq = heappop(open_lst)
+            if sq in closed:
+                continue
+            closed.add(sq)
+            for n, info in map.neighbors(sq, True):
+                if n in closed or not is_free(n):
+                    continue
+                if map.is_corner(sq, n):
+                    if not map.is_free_corner(sq, n, is_free):
+                        continue
+                    ndist = dist + SQRT2
+                else:
+                    ndist = dist + 1
+                if ndist < distances.get(n, float('inf')):
+                    distances[n] = ndist
+                    heappush(open_lst, (ndist, n))
+
+    def __contains__(self, pos):
+        return pos in self.distances
+
+    def distance(self, pos):
+        return self.distances.get(pos)
+
+    def next_step(self, pos, pred=None):
+        """ returns the neighbor which is the first step of a shortest path
+        to the goal. If pred is specified, only neighbors that satisfy it
+        (including corners of a diagonal step) are considered and the step
+        must come closer to the goal. Returns None if there is no step """
+        map = self.map
+        distances = self.distances
+        check = pred or distances.__contains__
+        cur_dist = distances.get(pos, float('inf'))
+        best_key, best_pos = None, None
+        for n, info in map.neighbors(pos, True):
+            dist = distances.get(n)
+            if dist is None or dist >= cur_dist or not check(n):
+                continue
+            if map.is_corner(pos, n):
+                if not map.is_free_corner(pos, n, check):
+                    continue
+                step = SQRT2
+            else:
+                step = 1
+            # rounding hides the error of float sums of equal paths;
+            # a diagonal step is preferred like in Map.get_path
+            key = round(step + dist, 9), -step
+            if best_key is None or key < best_key:
+                best_key, best_pos = key, n
+        return best_pos
@@ -0,0 +1,168 @@
+from math import cos, sin, tan, radians, hypot, degrees, acos, floor, ceil
+
+# quadrants as (angle of the row axis, column axis, row axis),
+# a column grows clockwise, so every diagonal is the last column
+# of exactly one quadrant
+QUADRANTS = (
+    (90, (1, 0), (0, 1)),
+    (0, (0, -1), (1, 0)),
+    (270, (-1, 0), (0, -1)),
+    (180, (0, 1), (-1, 0)),
+)
+
+
+def angle_between(v1, v2):
+    l1 = hypot(v1[0], v1[1])
+    v1 = v1[0] / l1, v1[1] / l1
+    l2 = hypot(v2[0], v2[1])
+    v2 = v2[0] / l2, v2[1] / l2
+    return degrees(acos(v1[0] * v2[0] + v1[1] * v2[1]))
+
+
+def _less(first, second):
+    """ compares slopes stored as (numerator, positive denominator) """
+    return first[0] * second[1] < second[0] * first[1]
+
+
+def _equal(first, second):
+    return first[0] * second[1] == second[0] * first[1]
+
+
+def _in_window(slope, window):
+    low, low_closed, high, high_closed = window
+    if _less(low, slope) and _less(slope, high):
+        return True
+    return ((low_closed and _equal(slope, low)) or
+            (high_closed and _equal(slope, high)))
+
+
+def _cut(windows, low, high):
+    """ removes the closed interval [low, high] from windows """
+    result = []
+    for window in windows:
+        w_low, w_low_closed, w_high, w_high_closed = window
+        if _less(high, w_low) or _less(w_high, low):
+            result.append(window)
+            continue
+        if _less(w_low, low):
+            result.append((w_low, w_low_closed, low, False))
+        if _less(high, w_high):
+            result.append((high, False, w_high, w_high_closed))
+    return result
+
+
+def _shadow(col, row):
+    """ slopes of a square as seen from the origin, the square blocks
+    every ray which touches it """
+    slopes = [(2 * col + dc, 2 * row + dr) for dc in (-1, 1) for dr in (-1, 1)]
+    low = high = slopes[0]
+    for slope in slopes[1:]:
+        if _less(slope, low):
+            low = slope
+        if _less(high, slope):
+            high = slope
+    return low, high
+
+
+def shadowcast(map, pos, angle, cone_angle, radius, pred):
+    """ Field of view with the cone and radius of Map.view_field: a square is
+    visible if it is within radius and cone, satisfies pred and the segment
+    between centers doesn't touch an obstacle (a square within radius
+    and cone which doesn't satisfy pred). Quadrants are scanned row by row
+    keeping windows of unblocked slopes, a row is scanned only between
+    the first and the last window. Returns a list of visible squares """
+    assert 0 <= angle < 360, angle
+    assert 0 < cone_angle < 180, cone_angle
+    direction = cos(radians(angle)), sin(radians(angle))
+    half_cone = float(cone_angle) / 2
+    x, y = pos
+    checked = {}
+
+    def in_sight(sq):
+        """ True, False for an obstacle or None for squares out of sight """
+        try:
+            return checked[sq]
+        except KeyError:
+            pass
+        value = None
+        diff = sq[0] - x, sq[1] - y
+        if (hypot(diff[0], diff[1]) <= radius and sq in map and
+            angle_between(diff, direction) <= half_cone):
+            value = bool(pred(sq))
+        checked[sq] = value
+        return value
+
+    result = []
+    max_row = int(radius)
+    for axis_angle, (col_x, col_y), (row_x, row_y) in QUADRANTS:
+        # columns out of the cone are skipped
+        low = (angle - half_cone - axis_angle) % 360
+        if low + cone_angle >= 314:
+            low -= 360
+        high = min(low + cone_angle, 45)
+        low = max(low, -45)
+        if low > high + 1:
+            continue
+        low_slope = -tan(radians(min(high + 1, 45)))
+        high_slope = -tan(radians(max(low - 1, -45)))
+        # orthogonal neighbors of pos touch the diagonals
+        windows = [((-1, 1), in_sight((x - col_x, y - col_y)) is not False,
+                    (1, 1), in_sight((x + col_x, y + col_y)) is not False)]
+        for row in range(1, max_row + 1):
+            if not windows:
+                break
+            low_col = max(-row - 1, int(floor(low_slope * row)) - 1,
+                          windows[0][0][0] * row // windows[0][0][1] - 1)
+            high_col = min(row + 1, int(ceil(high_slope * row)) + 1,
+                           -(-windows[-1][2][0] * row //
+                             windows[-1][2][1]) + 1)
+            shadows = []
+            for col in range(low_col, high_col + 1):
+                sq = (x + col * col_x + row * row_x,
+                      y + col * col_y + row * row_y)
+                value = in_sight(sq)
+                if value is None:
+                    continue
+                if not value:
+                    # cells of neighbor quadrants touch the diagonals
+                    shadows.append(_shadow(col, row))
+                    continue
+                if not -row < col <= row:
+                    continue
+                slope = col, row
+                if not any(_in_window(slope, w) for w in windows):
+                    continue
+                if col == row:
+                    # the ray touches corners of side neighbors
+                    if (in_sight((sq[0] - col_x, sq[1] - col_y)) is False or
+                        in_sight((sq[0] - row_x, sq[1] - row_y)) is False):
+                        continue
+                result.append(sq)
+            for low, high in shadows:
+                windows = _cut(windows, low, high)
+    return result
+
+
+def supercover(start, end):
+    """ yields squares touched by the segment between centers of start
+    and end (both are excluded). If the segment passes through a corner,
+    both side squares are yielded """
+    x, y = start
+    dx, dy = end[0] - x, end[1] - y
+    step_x = (dx > 0) - (dx < 0)
+    step_y = (dy > 0) - (dy < 0)
+    dx, dy = abs(dx), abs(dy)
+    ix = iy = 0
+    while ix < dx or iy < dy:
+        decision = (1 + 2 * ix) * dy - (1 + 2 * iy) * dx
+        if decision == 0:
+            yield x + step_x, y
+            yield x, y + step_y
+            x, y = x + step_x, y + step_y
+            ix, iy = ix + 1, iy + 1
+        elif decision < 0:
+            x, ix = x + step_x, ix + 1
+        else:
+            y, iy = y + step_y, iy + 1
+        if (x, y) != end:
+            yield x, y
@@ -0,0 +1,133 @@
+from array import array
+
+WALK = 1
+JUMP = 2
+SEE = 4
+PRESENT = 128
+
+ACTION_BITS = {'walk': WALK, 'jump': JUMP, 'see': SEE}
+
+
+def action_flags(info):
+    flags = PRESENT
+    for action in info.get('actions', ()):
+        flags |= ACTION_BITS[action]
+    return flags
+
+
+class DenseGrid(object):
+    """ Dict-like storage of map squares. Keeps a row-major array of
+    definition codes and a layer of action flags. The arrays have a border
+    of empty squares, so an index of a neighbor of any stored square
+    is always valid """
+
+    def __init__(self, items=()):
+        self._infos = [None]
+        self._codes_by_id = {}
+        items = list(items)
+        if items:
+            xs = [pos[0] for pos, info in items]
+            ys = [pos[1] for pos, info in items]
+            self._reset_bounds(min(xs), min(ys), max(xs), max(ys))
+        else:
+            self._reset_bounds(0, 0, 0, 0)
+        for pos, info in items:
+            self[pos] = info
+
+    def _reset_bounds(self, min_x, min_y, max_x, max_y):
+        self.min_x, self.min_y = min_x - 1, min_y - 1
+        self.width = max_x - min_x + 3
+        self.height = max_y - min_y + 3
+        size = self.width * self.height
+        self._codes = array('H', [0]) * size
+        self.flags = array('B', [0]) * size
+        # (dx, dy, index offset) in order of Map._neighbors
+        self.offsets = tuple((dx, dy, dx + dy * self.width) for dx, dy in
+                             ((0, 1), (1, 1), (1, 0), (1, -1),
+                              (0, -1), (-1, -1), (-1, 0), (-1, 1)))
+
+    def _grow(self, pos):
+        items = self.items()
+        xs = [p[0] for p, i in items] + [pos[0]]
+        ys = [p[1] for p, i in items] + [pos[1]]
+        self._reset_bounds(min(xs), min(ys), max(xs), max(ys))
+        for p, info in items:
+            self[p] = info
+
+    def index(self, pos):
+        """ returns -1 if the position is out of bounds """
+        x = pos[0] - self.min_x
+        y = pos[1] - self.min_y
+        if 0 <= x < self.width and 0 <= y < self.height:
+            return y * self.width + x
+        return -1
+
+    def position(self, index):
+        y, x = divmod(index, self.width)
+        return x + self.min_x, y + self.min_y
+
+    def _code(self, info):
+        code = self._codes_by_id.get(id(info))
+        if code is None:
+            code = self._codes_by_id[id(info)] = len(self._infos)
+            self._infos.append(info)
+        return code
+
+    def get(self, pos, default=None):
+        x = pos[0] - self.min_x
+        y = pos[1] - self.min_y
+        if 0 <= x < self.width and 0 <= y < self.height:
+            code = self._codes[y * self.width + x]
+            if code:
+                return self._infos[code]
+        return default
+
+    def get_flags(self, pos):
+        x = pos[0] - self.min_x
+        y = pos[1] - self.min_y
+        if 0 <= x < self.width and 0 <= y < self.height:
+            return self.flags[y * self.width + x]
+        return 0
+
+    def refresh_flags(self):
+        """ must be called if actions of a definition were changed """
+        infos, flags = self._infos, self.flags
+        for index, code in enumerate(self._codes):
+            if code:
+                flags[index] = action_flags(infos[code])
+
+    def __getitem__(self, pos):
+        info = self.get(pos)
+        if info is None:
+            raise KeyError(pos)
+        return info
+
+    def __setitem__(self, pos, info):
+        x = pos[0] - self.min_x
+        y = pos[1] - self.min_y
+        if not (0 < x < self.width - 1 and 0 < y < self.height - 1):
+            self._grow(pos)
+        index = self.index(pos)
+        self._codes[index] = self._code(info)
+        self.flags[index] = action_flags(info)
+
+    def __delitem__(self, pos):
+        index = self.index(pos)
+        if index < 0 or not self._codes[index]:
+            raise KeyError(pos)
+        self._codes[index] = 0
+        self.flags[index] = 0
+
+    def __contains__(self, pos):
+        x = pos[0] - self.min_x
+        y = pos[1] - self.min_y
+        return (0 <= x < self.width and 0 <= y < self.height and
+                self.flags[y * self.width + x] != 0)
+
+    def __len__(self):
+        return sum(1 for code in self._codes if code)
+
+    def items(self):
+        infos, position = self._infos, self.position
+        return [(position(index), infos[code])
+                for index, code in enumerate(self._codes) if code]
@@ -0,0 +1,218 @@
+from heapq import heappush, heappop
+from collections import defaultdict
+from map_model.field import DistanceField
+from map_model.jps import octile
+
+# a border segment longer than this gets two entrances (at its ends)
+MAX_SINGLE_ENTRANCE = 6
+
+
+class HierarchicalMap(object):
+    """ Navigation layer for hierarchical pathfinding (HPA*).
+    The map is split into square clusters. Entrances are pairs of walkable
+    squares on both sides of a cluster border; entrances of a cluster are
+    connected by the lengths of shortest paths inside it. The abstract
+    graph is built over static walkability, dynamic obstacles are taken
+    into account only while refining the first segment of a path """
+
+    def __init__(self, map, cluster_size):
+        assert cluster_size > 1, cluster_size
+        self.map = map
+        self.cluster_size = cluster_size
+        self.expanded = 0
+        self._borders = {}
+        self._transitions = defaultdict(dict)
+        self._intra = {}
+        self._clusters = set(self.cluster(pos) for pos, info in map)
+        for cluster in self._clusters:
+            for border in self._own_borders(cluster):
+                self._build_border(border)
+        for cluster in self._clusters:
+            self._build_intra(cluster)
+
+    def cluster(self, pos):
+        return pos[0] // self.cluster_size, pos[1] // self.cluster_size
+
+    def is_far(self, first, second):
+        """ True if clusters of the squares are not adjacent """
+        first, second = self.cluster(first), self.cluster(second)
+        return max(abs(first[0] - second[0]), abs(first[1] - second[1])) > 1
+
+    def walkable(self, pos):
+        return self.map.has_action(pos, 'walk')
+
+    def _own_borders(self, cluster):
+        """ borders with the right and the top neighbors """
+        x, y = cluster
+        return ((cluster, (x + 1, y)), (cluster, (x, y + 1)))
+
+    def _borders_of(self, cluster):
+        x, y = cluster
+        return self._own_borders(cluster) + (((x - 1, y), cluster),
+                                             ((x, y - 1), cluster))
+
+    def _border_pairs(self, border):
+        first, second = border
+        size = self.cluster_size
+        if first[0] != second[0]:
+            x = second[0] * size
+            for y in range(first[1] * size, (first[1] + 1) * size):
+                yield (x - 1, y), (x, y)
+        else:
+            y = second[1] * size
+            for x in range(first[0] * size, (first[0] + 1) * size):
+                yield (x, y - 1), (x, y)
+
+    def _build_border(self, border):
+        segments, segment = [], []
+        for first, second in self._border_pairs(border):
+            if self.walkable(first) and self.walkable(second):
+                segment.append((first, second))
+            elif segment:
+                segments.append(segment)
+                segment = []
+        if segment:
+            segments.append(segment)
+        transitions = []
+        for segment in segments:
+            if len(segment) > MAX_SINGLE_ENTRANCE:
+                transitions.extend((segment[0], segment[-1]))
+            else:
+                transitions.append(segment[len(segment) // 2])
+        if transitions:
+            self._borders[border] = transitions
+        for first, second in transitions:
+            self._transitions[first][second] = 1
+            self._transitions[second][first] = 1
+
+    def _remove_border(self, border):
+        for first, second in self._borders.pop(border, ()):
+            for node, other in (first, second), (second, first):
+                self._transitions[node].pop(other, None)
+                if not self._transitions[node]:
+                    del self._transitions[node]
+
+    def entrances(self, cluster):
+        result = set()
+        for border in self._borders_of(cluster):
+            for first, second in self._borders.get(border, ()):
+                result.add(first if self.cluster(first) == cluster
+                           else second)
+        return result
+
+    def _cluster_field(self, goal, cluster, pred=None):
+        check = pred or self.walkable
+        in_cluster = lambda pos: (self.cluster(pos) == cluster and
+                                  check(pos))
+        return DistanceField(self.map, goal, in_cluster)
+
+    def _build_intra(self, cluster):
+        entrances = self.entrances(cluster)
+        edges = self._intra[cluster] = defaultdict(dict)
+        for node in entrances:
+            field = self._cluster_field(node, cluster)
+            for other in entrances:
+                dist = field.distance(other)
+                if other != node and dist is not None:
+                    edges[node][other] = dist
+
+    def rebuild_cluster(self, pos):
+        """ must be called when walkability of the square was changed """
+        cluster = self.cluster(pos)
+        if pos in self.map:
+            self._clusters.add(cluster)
+        borders = self._borders_of(cluster)
+        for border in borders:
+            self._remove_border(border)
+            self._build_border(border)
+        x, y = cluster
+        for c in (cluster, (x + 1, y), (x - 1, y), (x, y + 1), (x, y - 1)):
+            if c in self._clusters:
+                self._build_intra(c)
+
+    def _abstract_path(self, start, end):
+        """ A* over the abstract graph with temporary start and end nodes """
+        start_cluster, end_cluster = self.cluster(start), self.cluster(end)
+        start_field = self._cluster_field(start, start_cluster)
+        end_field = self._cluster_field(end, end_cluster)
+        start_edges = dict((n, start_field.distance(n))
+                           for n in self.entrances(start_cluster)
+                           if n in start_field and n != start)
+        end_edges = dict((n, end_field.distance(n))
+                         for n in self.entrances(end_cluster)
+                         if n in end_field and n != end)
+        if end in start_field:
+            start_edges[end] = start_field.distance(end)
+
+        def neighbors(node):
+            result = list(self._transitions.get(node, {}).items())
+            if node == start:
+                result.extend(start_edges.items())
+            else:
+                result.extend(self._intra.get(self.cluster(node), {})
+                                          .get(node, {}).items())
+            if node in end_edges:
+                result.append((end, end_edges[node]))
+            return result
+
+        open_lst = [(octile(start, end), 0, start)]
+        costs = {start: 0}
+        parents = {start: None}
+        closed = set()
+        while open_lst:
+            _, cost, node = heappop(open_lst)
+            if node in closed:
+                continue
+            closed.add(node)
+            self.expanded += 1
+            if node == end:
+                break
+            for n, step in neighbors(node):
+                if n in closed:
+                    continue
+                ncost = cost + step
+                if ncost < costs.get(n, float('inf')):
+                    costs[n] = ncost
+                    parents[n] = node
+                    heappush(open_lst, (ncost + octile(n, end), ncost, n))
+        if end not in closed:
+            return
+        path = [end]
+        while parents[path[-1]] is not None:
+            path.append(parents[path[-1]])
+        path.reverse()
+        return path
+
+    def get_path_prefix(self, start, end, pred):
+        """ returns the refined beginning of the path from start (excluded)
+        to end or None if the abstract path doesn't exist. If the refinement
+        is impossible because of dynamic obstacles, returns a path
+        of the full search """
+        map = self.map
+        if not pred(end):
+            return
+        if start == end:
+            return ()
+        cluster = self.cluster(start)
+        if cluster == self.cluster(end):
+            in_cluster = lambda pos: self.cluster(pos) == cluster and pred(pos)
+            path = map.get_path(start, end, in_cluster)
+            if path is not None:
+                return path
+        abstract = self._abstract_path(start, end)
+        if abstract is None:
+            return
+        # the segment is refined up to the last node of the abstract path
+        # before it leaves the clusters around start, it smooths detours
+        # through entrances
+        near = lambda pos: not self.is_far(start, pos)
+        waypoint = abstract[1]
+        for node in abstract[2:]:
+            if not near(node):
+                break
+            waypoint = node
+        path = map.get_path(start, waypoint,
+                            lambda pos: near(pos) and pred(pos))
+        if path is None:
+            return map.get_path(start, end, pred)
+        return path
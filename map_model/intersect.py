@@ -0,0 +1,54 @@
+try:
+    import numpy
+except ImportError: # callers use ObstacleEdges
+    numpy = None
+
+# vertices of a square relative to its center in doubled coordinates
+SQUARE_VERTICES = ((-1, 1), (1, 1), (1, -1), (-1, -1))
+# neighbors beyond the sides between the vertices
+SIDE_NEIGHBORS = ((0, 1), (1, 0), (0, -1), (-1, 0))
+
+
+def square_sides_array(squares):
+    """ sides of squares in doubled coordinates as two arrays of starts
+    and ends with the shape (count, 2). Sides shared by two squares are
+    skipped, a segment between points outside of the squares can't touch
+    them without touching other sides """
+    squares = set(squares)
+    starts, ends = [], []
+    for x, y in squares:
+        center = 2 * x, 2 * y
+        for num, (dx, dy) in enumerate(SIDE_NEIGHBORS):
+            if (x + dx, y + dy) in squares:
+                continue
+            start = SQUARE_VERTICES[num]
+            end = SQUARE_VERTICES[(num + 1) % 4]
+            starts.append((center[0] + start[0], center[1] + start[1]))
+            ends.append((center[0] + end[0], center[1] + end[1]))
+    return numpy.array(starts), numpy.array(ends)
+
+
+def _cross(first, second):
+    return first[..., 0] * second[..., 1] - first[..., 1] * second[..., 0]
+
+
+def crossing_mask(starts, ends, edge_starts, edge_ends):
+    """ Tests every segment against every edge at once. Arguments are
+    arrays with the shape (count, 2), the result is a boolean array with
+    the shape (len(ends), len(edge_starts)), starts may have one row
+    shared by all segments. A segment hits an edge
+    if they touch, parallel segments never hit as in segment_crossing.
+    The test is exact for integer coordinates """
+    starts = numpy.asarray(starts)[:, numpy.newaxis, :]
+    ends = numpy.asarray(ends)[:, numpy.newaxis, :]
+    edge_starts = numpy.asarray(edge_starts)[numpy.newaxis, :, :]
+    edge_ends = numpy.asarray(edge_ends)[numpy.newaxis, :, :]
+    direction = ends - starts
+    edge_direction = edge_ends - edge_starts
+    # sides of the lines where the ends of the other segment lie
+    edge_sides = (_cross(direction, edge_starts - starts) *
+                  _cross(direction, edge_ends - starts))
+    sides = (_cross(edge_direction, starts - edge_starts) *
+             _cross(edge_direction, ends - edge_starts))
+    return ((_cross(direction, edge_direction) != 0) &
+            (edge_sides <= 0) & (sides <= 0))
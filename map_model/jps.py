@@ -0,0 +1,201 @@
+from math import sqrt
+from heapq import heappush, heappop
+
+SQRT2 = sqrt(2)
+
+DIRECTIONS = (
+    (0, 1), (1, 1), (1, 0), (1, -1),
+    (0, -1), (-1, -1), (-1, 0), (-1, 1)
+)
+
+
+def octile(first, second):
+    dx = abs(first[0] - second[0])
+    dy = abs(first[1] - second[1])
+    return max(dx, dy) + (SQRT2 - 1) * min(dx, dy)
+
+
+def _sign(value):
+    return (value > 0) - (value < 0)
+
+
+class JumpPointSearch(object):
+    """ Jump Point Search for the 8-connected grid of the map where
+    a diagonal step is allowed only if both orthogonal squares are free
+    (the same rule as Map.is_free_corner). Nodes are positions """
+
+    def __init__(self, map, end, pred):
+        self.map = map
+        self.end = self.node(end)
+        self.pred = pred
+        self.expanded = 0
+        self._walkable = {}
+
+    def node(self, pos):
+        return pos
+
+    def position(self, node):
+        return node
+
+    def step(self, node, dx, dy):
+        return node[0] + dx, node[1] + dy
+
+    def walkable(self, node, dx=0, dy=0):
+        pos = node[0] + dx, node[1] + dy
+        try:
+            return self._walkable[pos]
+        except KeyError:
+            value = pos in self.map and bool(self.pred(pos))
+            self._walkable[pos] = value
+            return value
+
+    def _pruned_neighbors(self, node, parent):
+        walkable = self.walkable
+        if parent is None:
+            for dx, dy in DIRECTIONS:
+                if dx and dy and not (walkable(node, dx, 0) and
+                                      walkable(node, 0, dy)):
+                    continue
+                yield dx, dy
+            return
+        pos, parent = self.position(node), self.position(parent)
+        dx, dy = _sign(pos[0] - parent[0]), _sign(pos[1] - parent[1])
+        if dx and dy:
+            vertical = walkable(node, 0, dy)
+            horizontal = walkable(node, dx, 0)
+            if vertical:
+                yield 0, dy
+            if horizontal:
+                yield dx, 0
+            if vertical and horizontal:
+                yield dx, dy
+        elif dx:
+            next_free = walkable(node, dx, 0)
+            top, bottom = walkable(node, 0, 1), walkable(node, 0, -1)
+            if next_free:
+                yield dx, 0
+                if top:
+                    yield dx, 1
+                if bottom:
+                    yield dx, -1
+            if top:
+                yield 0, 1
+            if bottom:
+                yield 0, -1
+        else:
+            next_free = walkable(node, 0, dy)
+            right, left = walkable(node, 1, 0), walkable(node, -1, 0)
+            if next_free:
+                yield 0, dy
+                if right:
+                    yield 1, dy
+                if left:
+                    yield -1, dy
+            if right:
+                yield 1, 0
+            if left:
+                yield -1, 0
+
+    def _jump(self, node, dx, dy):
+        walkable = self.walkable
+        step = self.step
+        end = self.end
+        while True:
+            if not walkable(node):
+                return
+            if node == end:
+                return node
+            if dx and dy:
+                if (self._jump(step(node, dx, 0), dx, 0) is not None or
+                    self._jump(step(node, 0, dy), 0, dy) is not None):
+                    return node
+                if not (walkable(node, dx, 0) and walkable(node, 0, dy)):
+                    return
+            elif dx:
+                if ((walkable(node, 0, 1) and not walkable(node, -dx, 1)) or
+                    (walkable(node, 0, -1) and not walkable(node, -dx, -1))):
+                    return node
+            else:
+                if ((walkable(node, 1, 0) and not walkable(node, 1, -dy)) or
+                    (walkable(node, -1, 0) and not walkable(node, -1, -dy))):
+                    return node
+            node = step(node, dx, dy)
+
+    def search(self, start):
+        """ returns a tuple of jump points from start to end
+        (both are included) or None """
+        position = self.position
+        start, end = self.node(start), self.end
+        end_pos = position(end)
+        open_lst = [(octile(position(start), end_pos), 0, start)]
+        costs = {start: 0}
+        parents = {start: None}
+        closed = set()
+        while open_lst:
+            _, cost, sq = heappop(open_lst)
+            if sq in closed:
+                continue
+            closed.add(sq)
+            self.expanded += 1
+            if sq == end:
+                break
+            sq_pos = position(sq)
+            for dx, dy in self._pruned_neighbors(sq, parents[sq]):
+                jp = self._jump(self.step(sq, dx, dy), dx, dy)
+                if jp is None or jp in closed:
+                    continue
+                jp_pos = position(jp)
+                ncost = cost + octile(sq_pos, jp_pos)
+                if ncost < costs.get(jp, float('inf')):
+                    costs[jp] = ncost
+                    parents[jp] = sq
+                    heappush(open_lst,
+                             (ncost + octile(jp_pos, end_pos), ncost, jp))
+        if end not in closed:
+            return
+        points = [end]
+        while parents[points[-1]] is not None:
+            points.append(parents[points[-1]])
+        points.reverse()
+        return tuple(position(p) for p in points)
+
+
+class DenseJumpPointSearch(JumpPointSearch):
+    """ The same search over indices of DenseGrid """
+
+    def __init__(self, map, end, pred):
+        grid = map._data
+        self.flags = grid.flags
+        self.position = grid.position
+        self.width = grid.width
+        self.index = grid.index
+        super(DenseJumpPointSearch, self).__init__(map, end, pred)
+        # 0 - unknown, 1 - walkable, 2 - not walkable
+        self._walkable = bytearray(len(self.flags))
+
+    def node(self, pos):
+        return self.index(pos)
+
+    def step(self, node, dx, dy):
+        return node + dx + dy * self.width
+
+    def walkable(self, node, dx=0, dy=0):
+        index = node + dx + dy * self.width
+        state = self._walkable[index]
+        if not state:
+            state = 1 if (self.flags[index] and
+                          self.pred(self.position(index))) else 2
+            self._walkable[index] = state
+        return state == 1
+
+
+def expand_jump_points(points):
+    """ converts jump points into the path of adjacent squares
+    without the first point """
+    path = []
+    for (x, y), end in zip(points, points[1:]):
+        dx, dy = _sign(end[0] - x), _sign(end[1] - y)
+        while (x, y) != end:
+            x, y = x + dx, y + dy
+            path.append((x, y))
+    return tuple(path)
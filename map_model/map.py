@@ -1,8 +1,26 @@
-from math import atan2, hypot, degrees, radians, sqrt, cos, sin, acos
+from math import hypot, radians, sqrt, cos, sin
 from heapq import heappush, heappop
 from collections import OrderedDict, defaultdict, deque
 import yaml
 from map_model.check import MapDataError, check_map_data as check_data
+from map_model.jps import (
+    JumpPointSearch,
+    DenseJumpPointSearch,
+    expand_jump_points
+)
+from map_model.grid import DenseGrid, ACTION_BITS
+from map_model.hpa import HierarchicalMap
+from map_model.regions import RegionLabels
+from map_model.fov import shadowcast, supercover, angle_between
+from map_model.cache import LRUCache
+from map_model.field import DistanceField
+from map_model.occupancy import Occupancy, BLOCKED
+from map_model.edges import ObstacleEdges
+from map_model.intersect import numpy, crossing_mask, square_sides_array
+
+# slack of vectorized tests of radius and cone, squares on borders
+# are tested exactly
+EPSILON = 1e-6
 
 
 def segment_crossing(segm1, segm2):
@@ -46,23 +64,6 @@ def segment_crossing(segm1, segm2):
     return x_cross, y_cross
 
 
-def square_sides(pos):
-    x, y = pos
-    vertices = deque(((-.5, .5), (.5, .5), (.5, -.5), (-.5, -.5)))
-    for _ in range(4):
-        v1, v2 = tuple(vertices)[:2]
-        yield (x + v1[0], y + v1[1]), (x + v2[0], y + v2[1])
-        vertices.rotate(-1)
-
-
-def angle_between(v1, v2):
-    l1 = hypot(v1[0], v1[1])
-    v1 = v1[0] / l1, v1[1] / l1
-    l2 = hypot(v2[0], v2[1])
-    v2 = v2[0] / l2, v2[1] / l2
-    return degrees(acos(v1[0] * v2[0] + v1[1] * v2[1]))
-
-
 class Map(object):
     _neighbors = OrderedDict((
         ('top', (0, 1)),
@@ -76,8 +77,17 @@ class Map(object):
     ))
 
     _reverse_neighbors = dict((v, k) for k, v in _neighbors.items())
+    _all_neighbors = tuple(_neighbors.items())
+    _side_neighbors = _all_neighbors[::2]
 
-    def __init__(self, name=None, data=None, check=True):
+    path_algorithms = ('astar', 'jps')
+    fov_algorithms = ('wave', 'shadowcast')
+
+    def __init__(self, name=None, data=None, check=True,
+                 path_algorithm='astar', dense=False, cluster_size=0,
+                 fov_algorithm='wave', view_cache_size=0):
+        assert path_algorithm in self.path_algorithms, path_algorithm
+        assert fov_algorithm in self.fov_algorithms, fov_algorithm
         if data is None:
             with open(S.map(name), 'r') as f:
                 data = yaml.load(f)
@@ -86,7 +96,14 @@ class Map(object):
         self._name = name
         self._check = check
         self._raise_error_message(check_data(data))
-        self.blocked_squares = set()
+        self.path_algorithm = path_algorithm
+        self.fov_algorithm = fov_algorithm
+        # fields of the 'see' action, it's disabled if size is 0
+        self.view_cache = (LRUCache(view_cache_size)
+                           if view_cache_size else None)
+        self._sight_edges = None
+        self.expanded_nodes = 0 # for benchmarking of pathfinding
+        self.crossing_pairs = 0 # rays and sides tested by crossing_mask
         self.start_pos = tuple(data['start_position'])
         self.escape_position = tuple(data['escape_position'])
         self.hour = data.get('hour', 0)
@@ -115,7 +132,21 @@ class Map(object):
                 self.groups[ident].append((index / 3, num_row))
                 if info.get('kind', 'empty') == 'texture':
                     self.textures.add(info['texture'])
+        self.dense = dense
+        if dense:
+            self._data = DenseGrid(self._data.items())
+        self.regions = RegionLabels(self)
+        # dynamic obstacles, they are maintained by characters and bodies
+        self.occupancy = Occupancy(self)
+        # navigation layer for long paths, it's disabled if size is 0
+        self.hierarchy = (HierarchicalMap(self, cluster_size)
+                          if cluster_size else None)
+        # distance fields to fixed goals, see goal_field
+        self.goal_fields = {}
+        self.goal_field(self.escape_position)
         self.routes = {}
+        # paths between consecutive route points, see route_leg
+        self.route_legs = {}
         for key, value in data.get('routes', {}).items():
             self.routes[key] = tuple(tuple(i) for i in value)
         self.npcs = data.get('npcs', tuple())
@@ -142,13 +173,12 @@ class Map(object):
                     continue
 
             if check_path:
-                pred = lambda pos: 'walk' in self[pos]['actions']
                 route = deque(route)
                 for _ in range(len(route)):
                     s, e = tuple(route)[:2]
                     error = ("{0} - {1} interval of route '{2}' "
                             "is not passable").format(s, e, key)
-                    if self.get_path(s, e, pred) is None:
+                    if self.route_leg(s, e) is None:
                         yield 'route', error
                     route.rotate(1)
         for num, npc in enumerate(self.npcs):
@@ -164,9 +194,35 @@ class Map(object):
 
     def __delitem__(self, coord):
         del self._data[coord]
+        self._square_changed(coord)
 
     def __setitem__(self, coord, group):
         self._data[coord] = group
+        self._square_changed(coord)
+
+    def _square_changed(self, coord):
+        if self.view_cache is not None:
+            self.view_cache.clear()
+        self._sight_edges = None
+        self.route_legs.clear()
+        self.goal_fields = dict.fromkeys(self.goal_fields)
+        self.regions.update(coord)
+        if self.hierarchy is not None:
+            self.hierarchy.rebuild_cluster(coord)
+
+    def definition_changed(self):
+        """ must be called if actions of a definition were changed """
+        if self.dense:
+            self._data.refresh_flags()
+        if self.view_cache is not None:
+            self.view_cache.clear()
+        self._sight_edges = None
+        self.route_legs.clear()
+        self.goal_fields = dict.fromkeys(self.goal_fields)
+        self.regions = RegionLabels(self)
+        if self.hierarchy is not None:
+            self.hierarchy = HierarchicalMap(self,
+                                             self.hierarchy.cluster_size)
 
     def __iter__(self):
         return self._data.items().__iter__()
@@ -186,17 +242,23 @@ class Map(object):
         ys = [p[1] for p, i in self]
         return int((max(xs) + min(xs)) / 2), int((max(ys) + min(ys)) / 2)
 
+    def has_action(self, pos, action):
+        if self.dense:
+            return bool(self._data.get_flags(pos) & ACTION_BITS[action])
+        info = self._data.get(pos)
+        return info is not None and action in info.get('actions', ())
+
     def neighbors(self, coord, all=False, yield_names=False):
-        keys = self._neighbors.keys()
-        keys = keys if all else keys[::2]
-        for key in keys:
-            offset = self._neighbors[key]
-            pos = coord[0] + offset[0], coord[1] + offset[1]
-            if self[pos] is not None:
+        get = self._data.get
+        x, y = coord
+        for key, offset in self._all_neighbors if all else self._side_neighbors:
+            pos = x + offset[0], y + offset[1]
+            info = get(pos)
+            if info is not None:
                 if yield_names:
-                    yield key, self[pos]
+                    yield key, info
                 else:
-                    yield pos, self[pos]
+                    yield pos, info
 
     def wave(self, coord, pred=lambda x: True):
         assert self[coord], coord
@@ -214,27 +276,151 @@ class Map(object):
             yield new_wave
             wave = new_wave
 
-    def get_path(self, start, end, pred):
+    def is_reachable(self, start, end):
+        """ False if no path over walkable squares connects start and end """
+        return self.regions.connected(start, end)
+
+    def get_path(self, start, end, pred, algorithm=None, walk_pred=False):
+        """ returns a tuple of squares from start (excluded) to end
+        (included) or None if the end is unreachable. walk_pred must be set
+        if pred allows only walkable squares, then ends in other regions
+        are rejected without a search """
+        if walk_pred and start != end and not self.is_reachable(start, end):
+            return
+        algorithm = algorithm or self.path_algorithm
+        if algorithm == 'jps':
+            return self._jps_path(start, end, pred)
+        if self.dense:
+            return self._dense_astar_path(start, end, pred)
+        return self._astar_path(start, end, pred)
+
+    def goal_field(self, goal):
+        """ returns the distance field over walkable squares to the goal.
+        Fields are kept for all requested goals and are rebuilt on demand
+        after the map is changed. The field to escape_position
+        is built at load """
+        field = self.goal_fields.get(goal)
+        if field is None:
+            pred = lambda pos: self.has_action(pos, 'walk')
+            field = self.goal_fields[goal] = DistanceField(self, goal, pred)
+        return field
+
+    def route_leg(self, start, end):
+        """ returns a tuple of squares of the path over walkable squares
+        from start to end (both included) or None if the end is unreachable.
+        Legs of routes are computed by the check of routes and are kept
+        until the map is changed """
+        key = start, end
+        if key not in self.route_legs:
+            pred = lambda pos: self.has_action(pos, 'walk')
+            path = self.get_path(start, end, pred, walk_pred=True)
+            self.route_legs[key] = (None if path is None
+                                    else (start,) + tuple(path))
+        return self.route_legs[key]
+
+    def get_path_prefix(self, start, end, pred):
+        """ returns the beginning of a path from start to end, which is
+        enough for the next step. pred must allow only walkable squares.
+        The hierarchical layer refines only the segment to the first
+        cluster entrance, without it the whole path is returned """
+        if not self.is_reachable(start, end):
+            return
+        if self.hierarchy is None:
+            return self.get_path(start, end, pred)
+        return self.hierarchy.get_path_prefix(start, end, pred)
+
+    def get_path_multi(self, start, goals, pred, walk_pred=False):
+        """ returns a tuple (goal, path, length) for the nearest of goals,
+        where path is a tuple of squares from start (excluded) to the goal
+        (included), or None if all goals are unreachable. One search
+        stops at the first goal reached, walk_pred has the same meaning
+        as for get_path """
+        goals = set(g for g in goals if g == start or pred(g))
+        if walk_pred:
+            goals = set(g for g in goals if self.is_reachable(start, g))
+        if not goals:
+            return
+        def heuristic(pos):
+            return min(hypot(g[0] - pos[0], g[1] - pos[1]) for g in goals)
+
+        open_lst = [(0, 0, start)]
+        visited = {start: None}
+        lengths = {start: 0}
+        closed = set()
+        while open_lst:
+            cost, length, sq = heappop(open_lst)
+            length = -length # ties are broken in favour of longer lengths
+            if sq in closed:
+                continue
+            closed.add(sq)
+            self.expanded_nodes += 1
+            if sq in goals:
+                break
+            for n, info in self.neighbors(sq, True):
+                if n in closed or not pred(n):
+                    continue
+                is_corner = self.is_corner(sq, n)
+                if is_corner and not self.is_free_corner(sq, n, pred):
+                    continue
+                step_length = sqrt(2) if is_corner else 1
+                nlength = length + step_length
+                if nlength >= lengths.get(n, float('inf')):
+                    continue
+                lengths[n] = nlength
+                heappush(open_lst, (nlength + heuristic(n), -nlength, n))
+                visited[n] = sq
+        else:
+            return
+        goal = parent = sq
+        path = []
+        while parent is not None:
+            path.append(parent)
+            parent = visited[parent]
+        path.reverse()
+        return goal, tuple(path[1:]), length
+
+    def _jps_path(self, start, end, pred):
+        if not pred(end):
+            return
+        search_cls = DenseJumpPointSearch if self.dense else JumpPointSearch
+        search = search_cls(self, end, pred)
+        points = search.search(start)
+        self.expanded_nodes += search.expanded
+        if points is None:
+            return
+        return expand_jump_points(points)
+
+    def _astar_path(self, start, end, pred):
         if not pred(end):
             return
         open_lst = [(0 , 0, start)]
         visited = {start: None}
+        lengths = {start: 0}
+        closed = set()
         while open_lst:
             cost, length, sq = heappop(open_lst)
+            length = -length # ties are broken in favour of longer lengths
+            if sq in closed:
+                continue
+            closed.add(sq)
+            self.expanded_nodes += 1
             if sq == end:
                 break
             for n, info in self.neighbors(sq, True):
-                if n in visited or not pred(n):
+                if n in closed or not pred(n):
                     continue
                 is_corner = self.is_corner(sq, n)
                 if is_corner and not self.is_free_corner(sq, n, pred):
                     continue
                 step_length = sqrt(2) if is_corner else 1
                 nlength = length + step_length
-                cost = length + hypot(end[0] - n[0], end[1] - n[1])
-                heappush(open_lst, (cost, length, n))
+                if nlength >= lengths.get(n, float('inf')):
+                    continue
+                lengths[n] = nlength
+                cost = nlength + hypot(end[0] - n[0], end[1] - n[1])
+                heappush(open_lst, (cost, -nlength, n))
                 visited[n] = sq
-        if end not in visited:
+        if end not in closed:
             return
         parent = visited[end]
         path = [end]
@@ -244,33 +430,86 @@ class Map(object):
         path.reverse()
         return tuple(path[1:])
 
+    def _dense_astar_path(self, start, end, pred):
+        """ the same search as _astar_path over indices of the dense grid """
+        if not pred(end):
+            return
+        grid = self._data
+        flags, position = grid.flags, grid.position
+        width = grid.width
+        # 0 - unknown, 1 - free, 2 - not free
+        states = bytearray(len(flags))
+        def is_free(index):
+            state = states[index]
+            if not state:
+                state = 1 if flags[index] and pred(position(index)) else 2
+                states[index] = state
+            return state == 1
+
+        start_index, end_index = grid.index(start), grid.index(end)
+        open_lst = [(0, 0, start, start_index)]
+        visited = {start_index: None}
+        lengths = {start_index: 0}
+        closed = bytearray(len(flags))
+        diagonal_length = sqrt(2)
+        while open_lst:
+            cost, length, sq, index = heappop(open_lst)
+            length = -length
+            if closed[index]:
+                continue
+            closed[index] = 1
+            self.expanded_nodes += 1
+            if index == end_index:
+                break
+            for dx, dy, offset in grid.offsets:
+                n = index + offset
+                if closed[n] or not is_free(n):
+                    continue
+                if dx and dy:
+                    if not (is_free(index + dy * width) and
+                            is_free(index + dx)):
+                        continue
+                    nlength = length + diagonal_length
+                else:
+                    nlength = length + 1
+                if nlength >= lengths.get(n, float('inf')):
+                    continue
+                lengths[n] = nlength
+                pos = position(n)
+                cost = nlength + hypot(end[0] - pos[0], end[1] - pos[1])
+                heappush(open_lst, (cost, -nlength, pos, n))
+                visited[n] = index
+        if not closed[end_index]:
+            return
+        path = []
+        index = end_index
+        while index != start_index:
+            path.append(position(index))
+            index = visited[index]
+        path.reverse()
+        return tuple(path)
+
     def get_jump_field(self, pos):
+        has_action = self.has_action
+        pred = lambda pos: has_action(pos, 'jump')
         for nb1, info in self.neighbors(pos, True):
-            pred = lambda pos: 'jump' in self[pos]['actions']
             if self.is_corner(pos, nb1):
-                if ('walk' in info['actions'] and
-                    'jump' in info['actions'] and
+                if (has_action(nb1, 'walk') and
+                    has_action(nb1, 'jump') and
                     self.is_free_corner(pos, nb1, pred)):
                     yield nb1
-            elif 'jump' in info['actions']:
+            elif has_action(nb1, 'jump'):
                 diff = nb1[0] - pos[0], nb1[1] - pos[1]
                 nb2 = nb1[0] + diff[0], nb1[1] + diff[1]
-                if (nb2 in self and
-                    'walk' in self[nb2]['actions'] and
-                    'jump' in info['actions']):
+                if has_action(nb2, 'walk'):
                     yield nb2
 
     def is_corner(self, first, second):
-        diff = second[0] - first[0], second[1] - first[1]
-        return len(self._reverse_neighbors[diff].split('-')) == 2
+        return first[0] != second[0] and first[1] != second[1]
 
     def is_free_corner(self, first, second, pred=lambda pos: True):
         assert self.is_corner(first, second), (first, second)
-        diff = second[0] - first[0], second[1] - first[1]
-        nb_names = self._reverse_neighbors[diff].split('-')
-        for nb_name in nb_names:
-            nb_diff = self._neighbors[nb_name]
-            nb_pos = first[0] + nb_diff[0], first[1] + nb_diff[1]
+        for nb_pos in (first[0], second[1]), (second[0], first[1]):
             if nb_pos not in self:
                 return False
             if not pred(nb_pos):
@@ -285,40 +524,150 @@ class Map(object):
                 return True
         return False
 
-    def view_field(self, pos, angle, cone_angle, radius, pred):
+    @property
+    def sight_edges(self):
+        """ outline of squares without the 'see' action, it's rebuilt
+        after changes of the map """
+        if self._sight_edges is None:
+            self._sight_edges = ObstacleEdges(set(
+                pos for pos, info in self if not self.has_action(pos, 'see')))
+        return self._sight_edges
+
+    def view_field(self, pos, angle, cone_angle, radius, pred=None,
+                   algorithm=None):
+        """ returns a list of squares which can be seen from pos,
+        pred is the 'see' action if it's None """
+        algorithm = algorithm or self.fov_algorithm
+        if algorithm == 'shadowcast':
+            pred = pred or (lambda sq: self.has_action(sq, 'see'))
+            return shadowcast(self, pos, angle, cone_angle, radius, pred)
+        return self._wave_view_field(pos, angle, cone_angle, radius, pred)
+
+    def sight_field(self, pos, angle, cone_angle, radius):
+        """ returns a frozenset of squares which can be seen from pos
+        through squares with the 'see' action. The result depends only on
+        the map, so it is cached. NPC perception (can_see with the wave
+        algorithm) and the debug view markers use it """
+        key = pos, angle, cone_angle, radius
+        cache = self.view_cache
+        if cache is not None:
+            field = cache.get(key)
+            if field is not None:
+                return field
+        field = frozenset(self.view_field(pos, angle, cone_angle, radius))
+        if cache is not None:
+            cache[key] = field
+        return field
+
+    def can_see(self, observer_pos, facing, cone_angle, radius, target_pos):
+        """ True if target_pos is in the field of view of the observer over
+        squares with the 'see' action. The wave field is looked up in
+        sight_field, for shadowcasting only squares along the line of sight
+        are checked, the result is the same as for the shadowcast field """
+        if self.fov_algorithm == 'wave':
+            return target_pos in self.sight_field(observer_pos, facing,
+                                                  cone_angle, radius)
+        direction = cos(radians(facing)), sin(radians(facing))
+        half_cone = float(cone_angle) / 2
+        x, y = observer_pos
+
+        def in_sight(sq):
+            diff = sq[0] - x, sq[1] - y
+            return (hypot(diff[0], diff[1]) <= radius and
+                    angle_between(diff, direction) <= half_cone)
+
+        if (target_pos == observer_pos or not in_sight(target_pos) or
+            not self.has_action(target_pos, 'see')):
+            return False
+        for sq in supercover(observer_pos, target_pos):
+            if (sq in self and not self.has_action(sq, 'see') and
+                in_sight(sq)):
+                return False
+        return True
+
+    def _wave_view_field(self, pos, angle, cone_angle, radius, pred):
+        """ obstacles are squares within radius and cone which don't satisfy
+        pred (the 'see' action if it's None). Rays to all squares are tested
+        against sides of obstacles at once by crossing_mask. Without NumPy
+        rays are tested against outlines of the same obstacles: sight_edges
+        if pred is None, otherwise edges of obstacles in sight """
         assert 0 <= angle < 360, angle
         assert 0 < cone_angle < 180, cone_angle
 
         direction = cos(radians(angle)), sin(radians(angle))
         half_cone = float(cone_angle) / 2
-        def field_pred(sq):
+        def in_sight(sq):
             diff = sq[0] - pos[0], sq[1] - pos[1]
-            if hypot(diff[0], diff[1]) > radius:
-                return False
-            angle = angle_between(diff, direction)
-            if angle > half_cone:
-                return False
-            if not pred(sq):
-                obstacles.add(sq)
-                return False
-            for obst in obstacles:
-                for side in square_sides(obst):
-                    if segment_crossing((pos, sq), side) is not None:
-                        return False
-            return True
-
-        obstacles = set()
+            return (sq != pos and hypot(diff[0], diff[1]) <= radius and
+                    angle_between(diff, direction) <= half_cone)
+
+        if numpy is not None:
+            field_pred = self._visible_squares(pos, direction, half_cone,
+                                               radius, in_sight,
+                                               pred).__contains__
+        elif pred is None:
+            edges = self.sight_edges
+            def field_pred(sq):
+                return (in_sight(sq) and self.has_action(sq, 'see') and
+                        not edges.crosses(pos, sq, in_sight))
+        else:
+            size = int(radius)
+            edges = ObstacleEdges(set(
+                sq for sq in ((pos[0] + dx, pos[1] + dy)
+                              for dx in range(-size, size + 1)
+                              for dy in range(-size, size + 1))
+                if sq in self and in_sight(sq) and not pred(sq)))
+            def field_pred(sq):
+                return (in_sight(sq) and pred(sq) and
+                        not edges.crosses(pos, sq))
         return sum(self.wave(pos, field_pred), [])
 
+    def _visible_squares(self, pos, direction, half_cone, radius, in_sight,
+                         pred):
+        """ squares in sight which satisfy pred and can be seen from pos.
+        Offsets are selected by radius and cone with NumPy, only offsets
+        near borders are checked by in_sight """
+        pred = pred or (lambda sq: self.has_action(sq, 'see'))
+        size = int(radius)
+        offsets = numpy.mgrid[-size:size + 1, -size:size + 1].reshape(2, -1)
+        dist = numpy.hypot(offsets[0], offsets[1])
+        cos_half = cos(radians(half_cone))
+        with numpy.errstate(invalid='ignore', divide='ignore'):
+            # the offset of pos is nan
+            cos_angle = (offsets[0] * direction[0] +
+                         offsets[1] * direction[1]) / dist
+            near = ((dist > 0) & (dist <= radius + EPSILON) &
+                    (cos_angle >= cos_half - EPSILON))
+            inner = ((dist <= radius - EPSILON) &
+                     (cos_angle >= cos_half + EPSILON))[near].tolist()
+        squares, obstacles = [], []
+        x, y = pos
+        for (dx, dy), sure in zip(offsets[:, near].T.tolist(), inner):
+            sq = x + dx, y + dy
+            if sq in self and (sure or in_sight(sq)):
+                (squares if pred(sq) else obstacles).append(sq)
+        if not squares or not obstacles:
+            return set(squares)
+        ends = 2 * numpy.array(squares)
+        sides = square_sides_array(obstacles)
+        self.crossing_pairs += len(ends) * len(sides[0])
+        blocked = crossing_mask([(2 * x, 2 * y)], ends, *sides).any(axis=1)
+        return set(sq for sq, hidden in zip(squares, blocked) if not hidden)
+
+    @property
+    def blocked_squares(self):
+        return self.occupancy.squares(BLOCKED)
+
     def block(self, pos):
-        assert self[pos] and pos not in self.blocked_squares
-        self.blocked_squares.add(pos)
+        assert self[pos] and self.occupancy.is_free(pos, BLOCKED)
+        self.occupancy.set(pos, BLOCKED)
 
     def is_available(self, pos):
-        return pos in self and pos not in self.blocked_squares
+        return pos in self and self.occupancy.is_free(pos, BLOCKED)
 
     def unblock(self, pos):
-        self.blocked_squares.remove(pos)
+        assert not self.occupancy.is_free(pos, BLOCKED), pos
+        self.occupancy.clear(pos, BLOCKED)
 
     def _get_line(self, fpos, spos):
         """ [start, end) """
@@ -0,0 +1,71 @@
+from collections import defaultdict
+
+BLOCKED = 1 # reserved by a step of a character, see Map.block
+NPC = 2 # a standing NPC
+PLAYER = 4 # the standing player
+BODY = 8
+ALL = BLOCKED | NPC | PLAYER | BODY
+
+
+class Occupancy(object):
+    """ Flags of dynamic obstacles per square. Only occupied squares are
+    stored. Every change increments the global version and the version of
+    the region (a label of Map.regions) of the square, so caches can
+    check cheaply if anything was changed """
+
+    def __init__(self, map):
+        self.map = map
+        self.flags = {}
+        self.version = 0
+        self.region_versions = defaultdict(int)
+        self._squares = {}
+        self._items = None, None
+
+    def get(self, pos):
+        return self.flags.get(pos, 0)
+
+    def is_free(self, pos, mask=ALL):
+        return not self.flags.get(pos, 0) & mask
+
+    def set(self, pos, flag):
+        value = self.flags.get(pos, 0)
+        if value & flag != flag:
+            self.flags[pos] = value | flag
+            self._changed(pos)
+
+    def clear(self, pos, flag):
+        value = self.flags.get(pos, 0)
+        if value & flag:
+            value &= ~flag
+            if value:
+                self.flags[pos] = value
+            else:
+                del self.flags[pos]
+            self._changed(pos)
+
+    def _changed(self, pos):
+        self.version += 1
+        self.region_versions[self.map.regions.labels.get(pos)] += 1
+
+    def region_version(self, pos):
+        """ the version of the region of pos """
+        return self.region_versions[self.map.regions.labels.get(pos)]
+
+    def squares(self, mask=ALL):
+        """ returns a frozenset of squares with any flag of the mask,
+        it's cached until the next change """
+        version, squares = self._squares.get(mask, (None, None))
+        if version != self.version:
+            squares = frozenset(pos for pos, value in self.flags.items()
+                                if value & mask)
+            self._squares[mask] = self.version, squares
+        return squares
+
+    def items(self):
+        """ returns a frozenset of pairs of occupied squares and their
+        flags, it's cached until the next change """
+        version, items = self._items
+        if version != self.version:
+            items = frozenset(self.flags.items())
+            self._items = self.version, items
+        return items
@@ -0,0 +1,169 @@
+import multiprocessing
+from time import time
+from Queue import Empty
+from collections import deque, namedtuple
+from itertools import count
+
+from map_model.jps import JumpPointSearch, expand_jump_points
+from map_model.occupancy import BLOCKED, NPC
+
+PATH_MASK = BLOCKED | NPC # squares which NPC.path_pred avoids
+PENDING = 'pending'
+STALE = 'stale'
+
+# path is the same as the result of Map.get_path, seconds and expanded
+# nodes of the search are for instrumentation
+PathResult = namedtuple('PathResult', 'path seconds expanded')
+
+
+def search_path(walk, blocked, start, end):
+    """ searches the path over the set of walkable squares without
+    blocked squares (the start may be blocked), returns PathResult """
+    start_time = time()
+    pred = lambda pos: pos not in blocked
+    if end not in walk or not pred(end):
+        return PathResult(None, time() - start_time, 0)
+    if start == end:
+        return PathResult((), time() - start_time, 0)
+    search = JumpPointSearch(walk, end, pred)
+    points = search.search(start)
+    path = None if points is None else expand_jump_points(points)
+    return PathResult(path, time() - start_time, search.expanded)
+
+
+def _worker(walk, tasks, results):
+    blocked = set()
+    while True:
+        task = tasks.get()
+        if task is None:
+            return
+        if task[0] == 'delta':
+            _, added, removed = task
+            blocked.difference_update(removed)
+            blocked.update(added)
+        else:
+            _, key, version, start, end = task
+            results.put((key, version, search_path(walk, blocked, start, end)))
+
+
+class PathPool(object):
+    """ Searches paths of NPCs in worker processes. Every worker gets
+    a snapshot of walkable squares once and then changes of squares
+    occupied by NPCs and steps (deltas), they are sent by sync once per
+    tick. A result is ready on a later frame and it's stale if a square
+    of the path was occupied after the version of the snapshot which
+    the search used """
+
+    def __init__(self, map, processes, log_size=256):
+        assert processes > 0, processes
+        self.map = map
+        walk = frozenset(pos for pos, info in map
+                         if map.has_action(pos, 'walk'))
+        self.version = 0
+        self._blocked = frozenset()
+        self._log = deque(maxlen=log_size) # (version, occupied squares)
+        self._keys = count()
+        self._done = {}
+        self._cancelled = set()
+        self.results = multiprocessing.Queue()
+        self.queues = []
+        self.workers = []
+        for _ in range(processes):
+            queue = multiprocessing.Queue()
+            worker = multiprocessing.Process(target=_worker,
+                                             args=(walk, queue, self.results))
+            worker.daemon = True
+            worker.start()
+            self.queues.append(queue)
+            self.workers.append(worker)
+        self.submitted = 0
+        self.discarded = 0
+        self.search_seconds = 0 # time of searches in workers
+        self.expanded = 0
+        self.sync()
+
+    def sync(self):
+        """ sends changes of the occupancy since the last call """
+        blocked = self.map.occupancy.squares(PATH_MASK)
+        if blocked is self._blocked:
+            return
+        added = blocked - self._blocked
+        removed = self._blocked - blocked
+        self._blocked = blocked
+        if not added and not removed:
+            return
+        self.version += 1
+        self._log.append((self.version, added))
+        for queue in self.queues:
+            queue.put(('delta', added, removed))
+
+    def submit(self, start, end):
+        """ returns a key of the request for result """
+        key = next(self._keys)
+        self.queues[key % len(self.queues)].put(
+            ('path', key, self.version, start, end))
+        self.submitted += 1
+        return key
+
+    def result(self, key):
+        """ returns PathResult, PENDING if the search isn't finished
+        or STALE if the result was discarded """
+        while True:
+            try:
+                done_key, version, result = self.results.get_nowait()
+            except Empty:
+                break
+            self.search_seconds += result.seconds
+            self.expanded += result.expanded
+            if done_key in self._cancelled:
+                self._cancelled.remove(done_key)
+                continue
+            self._done[done_key] = version, result
+        if key not in self._done:
+            return PENDING
+        version, result = self._done.pop(key)
+        if result.path is not None and self.is_stale(version, result.path):
+            self.discarded += 1
+            return STALE
+        return result
+
+    def cancel(self, key):
+        """ the result of the request won't be requested """
+        if self._done.pop(key, None) is None:
+            self._cancelled.add(key)
+
+    def is_stale(self, version, path):
+        if version == self.version:
+            return False
+        if not self._log or self._log[0][0] > version + 1:
+            return True # changes are forgotten
+        return any(changed_version > version and not added.isdisjoint(path)
+                   for changed_version, added in self._log)
+
+    def close(self):
+        for queue in self.queues:
+            queue.put(None)
+        for worker in self.workers:
+            worker.join()
+        self.queues, self.workers = [], []
+
+
+class PoolRequest(object):
+    """ A path request for the action system (see character.action.path),
+    result is PENDING until ready returns True """
+
+    def __init__(self, pool, start, end):
+        self.pool = pool
+        self.start = start
+        self.end = end
+        self.key = pool.submit(start, end)
+        self.result = PENDING
+
+    def ready(self):
+        if self.result is PENDING:
+            self.result = self.pool.result(self.key)
+        return self.result is not PENDING
+
+    def cancel(self):
+        if self.result is PENDING:
+            self.pool.cancel(self.key)
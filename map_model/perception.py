@@ -0,0 +1,48 @@
+try:
+    import numpy
+except ImportError: # the scalar fallback is used
+    numpy = None
+
+# slack of the vectorized prefilter, Map.can_see makes the exact test
+EPSILON = 1e-6
+
+
+def batch_can_see(map, observers, targets):
+    """ observers are tuples (pos, facing, cone_angle, radius). Returns
+    a list of frozensets of targets which can be seen by every observer.
+    Distance and cone are tested for all pairs at once with NumPy,
+    only remaining pairs are tested by Map.can_see """
+    if not observers or not targets:
+        return [frozenset() for _ in observers]
+    if numpy is None:
+        candidates = [range(len(targets))] * len(observers)
+    else:
+        candidates = _candidates(observers, targets)
+    result = []
+    for (pos, facing, cone_angle, radius), indices in zip(observers,
+                                                          candidates):
+        result.append(frozenset(
+            targets[i] for i in indices
+            if map.can_see(pos, facing, cone_angle, radius, targets[i])))
+    return result
+
+
+def _candidates(observers, targets):
+    """ indices of targets within radius and cone of every observer,
+    the test is loose on borders """
+    positions = numpy.array([o[0] for o in observers], dtype=float)
+    facings = numpy.radians([o[1] for o in observers])
+    half_cones = numpy.radians([o[2] for o in observers]) / 2
+    radiuses = numpy.array([o[3] for o in observers], dtype=float)
+    diff = (numpy.array(targets, dtype=float)[numpy.newaxis, :, :] -
+            positions[:, numpy.newaxis, :])
+    dist = numpy.hypot(diff[..., 0], diff[..., 1])
+    dot = (diff[..., 0] * numpy.cos(facings)[:, numpy.newaxis] +
+           diff[..., 1] * numpy.sin(facings)[:, numpy.newaxis])
+    with numpy.errstate(invalid='ignore', divide='ignore'):
+        cos_angle = dot / dist
+    visible = ((dist > 0) &
+               (dist <= radiuses[:, numpy.newaxis] + EPSILON) &
+               (cos_angle >= numpy.cos(half_cones)[:, numpy.newaxis] -
+                EPSILON))
+    return [numpy.flatnonzero(row) for row in visible]
@@ -0,0 +1,100 @@
+from collections import deque
+
+
+class RegionLabels(object):
+    """ Labels of connected regions of squares with the action. Regions use
+    the rules of Map.get_path, so squares with different labels are not
+    connected by any path over squares with the action """
+
+    def __init__(self, map, action='walk'):
+        self.map = map
+        self.action = action
+        self.labels = {}
+        self.members = {}
+        self._next_label = 0
+        for pos, info in map:
+            if pos not in self.labels and self.free(pos):
+                self._fill(pos, self._new_label())
+
+    def free(self, pos):
+        return self.map.has_action(pos, self.action)
+
+    def _new_label(self):
+        self._next_label += 1
+        return self._next_label
+
+    def _linked(self, pos):
+        """ free neighbors which can be reached by one step """
+        map = self.map
+        for n, info in map.neighbors(pos, True):
+            if not self.free(n):
+                continue
+            if map.is_corner(pos, n) and not map.is_free_corner(pos, n,
+                                                                self.free):
+                continue
+            yield n
+
+    def _fill(self, pos, label):
+        labels = self.labels
+        members = self.members[label] = set([pos])
+        labels[pos] = label
+        queue = deque([pos])
+        while queue:
+            for n in self._linked(queue.popleft()):
+                if labels.get(n) != label:
+                    labels[n] = label
+                    members.add(n)
+                    queue.append(n)
+
+    def label(self, pos):
+        return self.labels.get(pos)
+
+    def connected(self, start, end):
+        """ returns False if there is no path from start to end.
+        Start can be a square without the action, then its neighbors
+        are checked """
+        end_label = self.labels.get(end)
+        if end_label is None:
+            return False
+        if start in self.labels:
+            return self.labels[start] == end_label
+        return any(self.labels.get(n) == end_label
+                   for n, info in self.map.neighbors(start, True))
+
+    def update(self, pos):
+        """ must be called when the square gets or loses the action """
+        old_label = self.labels.get(pos)
+        if self.free(pos):
+            if old_label is not None:
+                return
+            self._merge(pos)
+        elif old_label is not None:
+            self._split(pos, old_label)
+
+    def _merge(self, pos):
+        labels, members = self.labels, self.members
+        linked = set(labels[n] for n in self._linked(pos))
+        if not linked:
+            label = self._new_label()
+            members[label] = set()
+        else:
+            # squares of smaller regions are relabeled
+            label = max(linked, key=lambda l: len(members[l]))
+            for other in linked - set([label]):
+                moved = members.pop(other)
+                for sq in moved:
+                    labels[sq] = label
+                members[label].update(moved)
+        labels[pos] = label
+        members[label].add(pos)
+
+    def _split(self, pos, old_label):
+        labels = self.labels
+        del labels[pos]
+        for sq in self.members.pop(old_label):
+            if sq != pos:
+                del labels[sq]
+        # every square of the old region is linked with a neighbor
+        for n, info in self.map.neighbors(pos, True):
+            if n not in labels and self.free(n):
+                self._fill(n, self._new_label())
@@ -0,0 +1,59 @@
+from math import hypot, ceil
+from collections import defaultdict
+
+
+class SpatialHash(object):
+    """ Uniform grid of buckets with positions of items. A query visits
+    only buckets which intersect the bounding square of the circle """
+
+    def __init__(self, cell_size):
+        assert cell_size > 0, cell_size
+        self.cell_size = int(ceil(cell_size))
+        self.positions = {}
+        self.buckets = defaultdict(set)
+
+    def _key(self, pos):
+        return pos[0] // self.cell_size, pos[1] // self.cell_size
+
+    def update(self, item, pos):
+        old_pos = self.positions.get(item)
+        if old_pos is not None:
+            key = self._key(old_pos)
+            if key == self._key(pos):
+                self.positions[item] = pos
+                return
+            self._discard(item, key)
+        self.positions[item] = pos
+        self.buckets[self._key(pos)].add(item)
+
+    def remove(self, item):
+        pos = self.positions.pop(item, None)
+        if pos is not None:
+            self._discard(item, self._key(pos))
+
+    def _discard(self, item, key):
+        bucket = self.buckets[key]
+        bucket.discard(item)
+        if not bucket:
+            del self.buckets[key]
+
+    def __contains__(self, item):
+        return item in self.positions
+
+    def __len__(self):
+        return len(self.positions)
+
+    def query_radius(self, pos, radius):
+        """ returns a list of items within the radius around pos """
+        x, y = pos
+        min_x, min_y = self._key((x - radius, y - radius))
+        max_x, max_y = self._key((x + radius, y + radius))
+        positions, buckets = self.positions, self.buckets
+        result = []
+        for bx in range(int(min_x), int(max_x) + 1):
+            for by in range(int(min_y), int(max_y) + 1):
+                for item in buckets.get((bx, by), ()):
+                    ipos = positions[item]
+                    if hypot(ipos[0] - x, ipos[1] - y) <= radius:
+                        result.append(item)
+        return result
@@ -6,7 +6,7 @@ import unittest
 from collections import deque, defaultdict
 import mock
 from character.char import Character
-from character.action import wait
+from character.action import wait, path, move, decision
 from character import action
 
 
@@ -37,11 +37,8 @@ class TestCharacter(unittest.TestCase):
         char.idle_frame = 2323
         char.pos = (3, 3)
 
-    @mock.patch('character.char.LerpHprInterval', interval_mock)
-    @mock.patch('character.char.LerpPosInterval', interval_mock)
     def test_walk(self):
         char = self.char
-        actor = char.actor
         char.walk_pred = mock.Mock(return_value=True)
         seff = ((3, 4), (4, 4), (5, 3))
         char.get_next_pos = mock.Mock(side_effect=seff)
@@ -49,18 +46,25 @@ class TestCharacter(unittest.TestCase):
         ret = next(gen)
         self.assertIsInstance(ret, wait)
         self.assertEqual(.05, ret.seconds)
-        walking_states = []
-        for _ in gen:
-            walking_states.append(char.walking)
-        self.assertListEqual([False, True, True, False, True], walking_states)
+        steps = []
+        for step in gen:
+            # every step is decided first
+            self.assertIsInstance(step, decision)
+            self.assertFalse(char.walking)
+            step = next(gen, None)
+            if step is None:
+                break
+            self.assertIsInstance(step, move)
+            self.assertTrue(char.walking)
+            self.assertEqual(step.pos, char.manager.map.block.call_args[0][0])
+            steps.append((step.pos, step.duration, step.heading, step.speed))
         exp = [
-            mock.call(actor, 0.5, (180, 0, 0), (90, 0, 0)),
-            mock.call(char.node, 1.0, (3, 4, 0)),
-            mock.call(char.node, 1.0, (4, 4, 0)),
-            mock.call(actor, 0.25, (45, 0, 0), (90, 0, 0)),
-            mock.call(char.node, 1.4, (5, 3, 0))
+            ((3, 4), 1.0, 180, 1.0),
+            ((4, 4), 1.0, 90, 1.0),
+            ((5, 3), 1.4, 45, 1.0),
         ]
-        self.assertListEqual(exp, self.interval_mock.call_args_list)
+        self.assertListEqual(exp, steps)
+        self.assertFalse(char.walking)
         exp = [mock.call(True, 100, 200)]
         self.assertListEqual(exp, self.anim_mock.loop.call_args_list)
         self.assertListEqual([mock.call(0.5)],
@@ -69,6 +73,22 @@ class TestCharacter(unittest.TestCase):
         self.assertEqual(3, char.manager.map.block.call_count)
         self.assertEqual(3, char.manager.map.unblock.call_count)
 
+    def test_walk_path_request(self):
+        char = self.char
+        char.walk_pred = mock.Mock(return_value=True)
+        request = path(mock.Mock())
+        char.get_next_pos = mock.Mock(side_effect=(request, (3, 4), None))
+        gen = char.do_walk()
+        next(gen)
+        self.assertIsInstance(next(gen), decision)
+        # the walk is resumed when the path is ready
+        self.assertIs(request, next(gen))
+        self.assertEqual(1, char.get_next_pos.call_count)
+        self.assertEqual((3, 3), char.pos)
+        list(gen)
+        self.assertEqual(3, char.get_next_pos.call_count)
+        self.assertEqual((3, 4), char.pos)
+
     def test_hit(self):
         char = self.char
         char.manager.npcs[3, 4] = target = mock.Mock()
@@ -2,7 +2,24 @@ import sys
 sys.path.insert(0, '')
 
 import unittest
+import random
+import time
+from fractions import Fraction
+from math import hypot, cos, sin, radians
+import yaml
+import mock
 from map_model.map import Map, segment_crossing
+from map_model.jps import octile
+from map_model.field import DistanceField
+from map_model.dstar import DStarLite
+from map_model.hpa import HierarchicalMap
+from map_model.regions import RegionLabels
+from map_model.fov import angle_between
+from map_model.perception import batch_can_see
+from map_model.occupancy import BLOCKED, NPC, BODY
+from map_model.spatial import SpatialHash
+from map_model.pathpool import PathPool, search_path, PENDING, STALE
+from map_model.intersect import crossing_mask, square_sides_array
 
 class TestMap(unittest.TestCase):
     maxDiff = None
@@ -18,6 +35,18 @@ class TestMap(unittest.TestCase):
         )
         return Map(data=data, check=False)
 
+    def load_map(self, name, **kwargs):
+        with open('maps/' + name, 'r') as f:
+            data = yaml.load(f)
+        return Map(name, data=data, check=False, **kwargs)
+
+    def path_cost(self, start, path):
+        cost, prev = 0, start
+        for pos in path:
+            cost += octile(prev, pos)
+            prev = pos
+        return cost
+
     def test_wave(self):
         top = [
             'ss ss ss ss ss ss ss ss',
@@ -101,6 +130,441 @@ class TestMap(unittest.TestCase):
         path = tuple(map.groups[i][0] for i in steps)
         self.assertEqual(path, res)
 
+    def test_get_path_jps(self):
+        top = [
+            'ss ss ss ss ss ss ss ss',
+            'ss WL WL ss ss ss ss ss',
+            'ss ss ss ss ss ss ss ss',
+            'ss ss ss ss .. .. ss ss',
+            'ss WL WL ss ss ss .. ss',
+            'ss ss st ss ss ss ss fn',
+        ]
+        defin = dict((i, {'kind':'empty'}) for i in ('WL', 'st', 'fn'))
+        map = self.get_map(defin, top)
+        pred = lambda pos: map[pos].get('ident') != 'WL'
+        start, end = map.groups['st'][0], map.groups['fn'][0]
+        res = map.get_path(start, end, pred, 'jps')
+        ref = map.get_path(start, end, pred, 'astar')
+        self.assertEqual(end, res[-1])
+        self.assertAlmostEqual(self.path_cost(start, ref),
+                               self.path_cost(start, res))
+        prev = start
+        for pos in res:
+            self.assertTrue(map.check_square(prev, pos, pred))
+            prev = pos
+        self.assertIsNone(map.get_path(start, map.groups['WL'][0],
+                                       pred, 'jps'))
+        self.assertEqual((), map.get_path(start, start, pred, 'jps'))
+
+    def test_get_path_multi(self):
+        map = self.load_map('bigmap.yaml')
+        pred = lambda pos: map.has_action(pos, 'walk')
+        squares = sorted(pos for pos, info in map if pred(pos))
+        rand = random.Random(0)
+        for _ in range(20):
+            start = rand.choice(squares)
+            goals = rand.sample(squares, 3)
+            costs = {}
+            for goal in goals:
+                path = map.get_path(start, goal, pred)
+                if path is not None:
+                    costs[goal] = self.path_cost(start, path)
+            found = map.get_path_multi(start, goals, pred, walk_pred=True)
+            if not costs:
+                self.assertIsNone(found)
+                continue
+            goal, path, length = found
+            self.assertEqual(goal, path[-1])
+            self.assertAlmostEqual(min(costs.values()), length)
+            self.assertAlmostEqual(costs[goal], self.path_cost(start, path))
+        self.assertEqual((start, (), 0),
+                         map.get_path_multi(start, [goal, start], pred))
+        wall = [pos for pos, info in map if not pred(pos)]
+        self.assertIsNone(map.get_path_multi(start, wall[:3], pred))
+
+    def test_route_legs(self):
+        map = self.load_map('bigmap.yaml')
+        self.assertTrue(map.routes)
+        for route in map.routes.values():
+            for start, end in zip(route, route[1:] + route[:1]):
+                leg = map.route_legs[start, end]
+                self.assertEqual((start, end), (leg[0], leg[-1]))
+                for first, second in zip(leg, leg[1:]):
+                    self.assertEqual(1, octile(first, second) // 1)
+                    self.assertTrue(map.has_action(second, 'walk'))
+                self.assertIs(leg, map.route_leg(start, end))
+        pos = leg[1]
+        del map[pos]
+        self.assertFalse(map.route_legs)
+        self.assertNotIn(pos, map.route_leg(start, end))
+
+    def test_goal_field(self):
+        map = self.load_map('bigmap.yaml')
+        escape = map.escape_position
+        pred = lambda pos: map.has_action(pos, 'walk')
+        field = map.goal_fields[escape]
+        self.assertEqual(DistanceField(map, escape, pred).distances,
+                         field.distances)
+        self.assertIs(field, map.goal_field(escape))
+        start = map.start_pos
+        start_field = map.goal_field(start)
+        self.assertEqual(0, start_field.distance(start))
+        pos = min(p for p, d in field.distances.items() if d == 1)
+        del map[pos]
+        self.assertEqual(dict.fromkeys((escape, start)), map.goal_fields)
+        self.assertNotIn(pos, map.goal_field(escape))
+        self.assertIsNot(field, map.goal_field(escape))
+
+    def test_get_path_jps_on_maps(self):
+        for name in ('bigmap.yaml', 'test_map.yaml'):
+            map = self.load_map(name)
+            pred = lambda pos: map.has_action(pos, 'walk')
+            squares = sorted(pos for pos, info in map if pred(pos))
+            rand = random.Random(0)
+            for _ in range(50):
+                start, end = rand.choice(squares), rand.choice(squares)
+                res = map.get_path(start, end, pred, 'jps')
+                ref = map.get_path(start, end, pred, 'astar')
+                if ref is None:
+                    self.assertIsNone(res)
+                    continue
+                self.assertEqual(len(ref), len(res))
+                self.assertAlmostEqual(self.path_cost(start, ref),
+                                       self.path_cost(start, res))
+
+    def test_distance_field(self):
+        map = self.load_map('test_map.yaml')
+        pred = lambda pos: map.has_action(pos, 'walk')
+        squares = sorted(pos for pos, info in map if pred(pos))
+        rand = random.Random(0)
+        for _ in range(10):
+            goal = rand.choice(squares)
+            field = DistanceField(map, goal, pred)
+            self.assertEqual(0, field.distance(goal))
+            self.assertIsNone(field.next_step(goal))
+            for _ in range(10):
+                start = rand.choice(squares)
+                path = map.get_path(start, goal, pred)
+                if path is None:
+                    self.assertNotIn(start, field)
+                    continue
+                cost = self.path_cost(start, path)
+                self.assertAlmostEqual(cost, field.distance(start))
+                step = field.next_step(start)
+                if start == goal:
+                    continue
+                self.assertTrue(map.check_square(start, step, pred))
+                self.assertAlmostEqual(cost, octile(start, step) +
+                                             field.distance(step))
+        top = [
+            'ss ss ss fn',
+            'st ss ss ss',
+        ]
+        defin = dict((i, {'kind':'empty'}) for i in ('st', 'fn'))
+        map = self.get_map(defin, top)
+        start, goal = map.groups['st'][0], map.groups['fn'][0]
+        field = DistanceField(map, goal, lambda pos: True)
+        self.assertEqual((1, 1), field.next_step(start))
+        pred = lambda pos: pos != (1, 1)
+        self.assertEqual((1, 0), field.next_step(start, pred))
+        pred = lambda pos: pos != (1, 0)
+        self.assertEqual((0, 1), field.next_step(start, pred))
+        pred = lambda pos: pos not in ((1, 0), (0, 1))
+        self.assertIsNone(field.next_step(start, pred))
+
+    def test_dstar_lite(self):
+        map = self.load_map('test_map.yaml')
+        squares = sorted(pos for pos, info in map
+                         if map.has_action(pos, 'walk'))
+        rand = random.Random(0)
+        for _ in range(5):
+            occupied = set(rand.sample(squares, 30))
+            pred = lambda pos: (map.has_action(pos, 'walk') and
+                                pos not in occupied)
+            planner = DStarLite(map, pred)
+            start, goal = rand.choice(squares), rand.choice(squares)
+            for num in range(20):
+                occupied.discard(start)
+                path = map.get_path(start, goal, pred)
+                step = planner.next_step(start, (goal,), frozenset(
+                    (pos, NPC) for pos in occupied))
+                if not path:
+                    self.assertIsNone(step)
+                    break
+                rest = map.get_path(step, goal, pred)
+                self.assertAlmostEqual(self.path_cost(start, path),
+                                       self.path_cost(start, (step,) + rest))
+                start = step
+                occupied.discard(rand.choice(sorted(occupied)))
+                occupied.add(rand.choice(squares))
+            self.assertEqual(1, planner.full_searches)
+            self.assertEqual(num, planner.repairs)
+        planner.next_step(start, (squares[0], squares[1]), frozenset())
+        self.assertEqual(2, planner.full_searches)
+
+    def test_dstar_lite_flags(self):
+        top = [
+            'ss ss ss ss ss',
+            'ss .. .. .. ss',
+            'ss ss ss ss ss',
+        ]
+        data = dict(
+            substrate_texture='grass',
+            substrate_actions=['walk', 'see'],
+            definitions={},
+            topology=top,
+            start_position=(0, 0),
+            escape_position=(0, 0),
+        )
+        map = Map(data=data, check=False)
+        occupancy = map.occupancy
+        pred = lambda pos: (map.has_action(pos, 'walk') and
+                            occupancy.is_free(pos, NPC))
+        planner = DStarLite(map, pred)
+        occupancy.set((2, 0), NPC)
+        self.assertEqual((0, 1), planner.next_step((0, 0), ((4, 0),),
+                                                   occupancy.items()))
+        # the square stays occupied, but a body doesn't block the planner
+        occupancy.set((2, 0), BODY)
+        occupancy.clear((2, 0), NPC)
+        self.assertEqual((1, 0), planner.next_step((0, 0), ((4, 0),),
+                                                   occupancy.items()))
+        self.assertEqual(1, planner.full_searches)
+
+    def test_path_pool(self):
+        map = self.load_map('test_map.yaml')
+        pred = lambda pos: map.has_action(pos, 'walk')
+        walk = frozenset(pos for pos, info in map if pred(pos))
+        squares = sorted(walk)
+        rand = random.Random(0)
+        for _ in range(50):
+            start, end = rand.choice(squares), rand.choice(squares)
+            path = search_path(walk, frozenset(), start, end).path
+            ref = map.get_path(start, end, pred)
+            self.assertEqual(ref is None, path is None)
+            if ref is not None:
+                self.assertAlmostEqual(self.path_cost(start, ref),
+                                       self.path_cost(start, path))
+
+        def wait(pool, key):
+            for _ in range(500):
+                result = pool.result(key)
+                if result is STALE:
+                    return result
+                if result is not PENDING:
+                    return result.path
+                time.sleep(.01)
+        start, end = (2, 2), (6, 2)
+        pool = PathPool(map, 2)
+        try:
+            path = wait(pool, pool.submit(start, end))
+            self.assertEqual(map.get_path(start, end, pred), path)
+            # the path is occupied before the result is requested
+            key = pool.submit(start, end)
+            map.occupancy.set(path[1], NPC)
+            pool.sync()
+            self.assertIs(STALE, wait(pool, key))
+            self.assertEqual(1, pool.discarded)
+            # the next search gets the delta
+            detour = wait(pool, pool.submit(start, end))
+            self.assertNotIn(path[1], detour)
+            map.occupancy.set(end, BLOCKED)
+            pool.sync()
+            self.assertIsNone(wait(pool, pool.submit(start, end)))
+            self.assertGreater(pool.expanded, 0)
+        finally:
+            pool.close()
+
+    def test_occupancy(self):
+        top = [
+            'ss ss WL ss ss',
+            'ss ss WL ss ss',
+        ]
+        map = self.get_map({'WL': {'kind':'empty'}}, top)
+        occupancy = map.occupancy
+        squares = occupancy.squares()
+        self.assertEqual(frozenset(), squares)
+        map.block((0, 0))
+        self.assertFalse(map.is_available((0, 0)))
+        self.assertTrue(occupancy.is_free((0, 0), NPC | BODY))
+        occupancy.set((0, 0), NPC)
+        occupancy.set((0, 0), NPC)
+        self.assertEqual(BLOCKED | NPC, occupancy.get((0, 0)))
+        self.assertEqual(2, occupancy.version)
+        self.assertEqual(2, occupancy.region_version((1, 1)))
+        self.assertEqual(0, occupancy.region_version((4, 1)))
+        squares = occupancy.squares()
+        self.assertIs(squares, occupancy.squares())
+        self.assertEqual(frozenset([(0, 0)]), map.blocked_squares)
+        map.unblock((0, 0))
+        occupancy.set((3, 0), BODY)
+        self.assertIsNot(squares, occupancy.squares())
+        self.assertEqual(frozenset([(0, 0), (3, 0)]), occupancy.squares())
+        self.assertEqual(frozenset(), map.blocked_squares)
+        self.assertEqual(1, occupancy.region_version((4, 1)))
+        occupancy.clear((0, 0), NPC)
+        occupancy.clear((0, 0), NPC)
+        self.assertEqual({(3, 0): BODY}, occupancy.flags)
+        self.assertEqual(5, occupancy.version)
+
+    def test_spatial_hash(self):
+        rand = random.Random(0)
+        index = SpatialHash(3)
+        positions = {}
+        for _ in range(300):
+            item = rand.randrange(40)
+            if rand.random() < 0.2:
+                index.remove(item)
+                positions.pop(item, None)
+            else:
+                pos = rand.randint(-10, 10), rand.randint(-10, 10)
+                index.update(item, pos)
+                positions[item] = pos
+            center = rand.randint(-10, 10), rand.randint(-10, 10)
+            radius = rand.choice((1, 2.5, 3, 7))
+            expected = [item for item, pos in positions.items()
+                        if hypot(pos[0] - center[0],
+                                 pos[1] - center[1]) <= radius]
+            self.assertItemsEqual(expected,
+                                  index.query_radius(center, radius))
+        self.assertEqual(len(positions), len(index))
+        self.assertEqual(sum(len(b) for b in index.buckets.values()),
+                         len(index))
+
+    def test_dense_storage(self):
+        top = [
+            'ss ss ss ss ss ss ss ss',
+            'ss WL WL ss ss ss ss ss',
+            'ss ss ss ss ss ss ss ss',
+            'ss ss st .. .. .. ss ss',
+            'ss ss WL .. ss .. .. ss',
+            'ss ss ss .. ss ss ss fn',
+        ]
+        defin = {
+            'st': {'kind': 'empty', 'actions': ['walk', 'jump', 'see']},
+            'fn': {'kind': 'empty', 'actions': ['walk', 'jump', 'see']},
+            'WL': {'kind': 'empty', 'actions': []}
+        }
+        map = self.get_map(defin, list(top))
+        data = dict(
+            substrate_texture='grass',
+            substrate_actions=['jump', 'walk', 'see'],
+            definitions=defin,
+            topology=list(top),
+            start_position=(0, 0),
+            escape_position=(0, 0),
+        )
+        dense_map = Map(data=data, check=False, dense=True)
+        self.assertItemsEqual(list(map), list(dense_map))
+        for x in range(-2, 10):
+            for y in range(-2, 8):
+                pos = x, y
+                self.assertEqual(pos in map, pos in dense_map)
+                self.assertEqual(map[pos], dense_map[pos])
+                for action in ('walk', 'jump', 'see'):
+                    self.assertEqual(map.has_action(pos, action),
+                                     dense_map.has_action(pos, action))
+                if pos not in map:
+                    continue
+                self.assertEqual(list(map.neighbors(pos, True)),
+                                 list(dense_map.neighbors(pos, True)))
+                self.assertEqual(list(map.get_jump_field(pos)),
+                                 list(dense_map.get_jump_field(pos)))
+        start, end = map.groups['st'][0], map.groups['fn'][0]
+        for algorithm in map.path_algorithms:
+            pred = lambda pos: map.has_action(pos, 'walk')
+            dense_pred = lambda pos: dense_map.has_action(pos, 'walk')
+            self.assertEqual(map.get_path(start, end, pred, algorithm),
+                             dense_map.get_path(start, end, dense_pred,
+                                                algorithm))
+        pred = lambda pos: map.has_action(pos, 'see')
+        dense_pred = lambda pos: dense_map.has_action(pos, 'see')
+        self.assertItemsEqual(map.view_field(start, 0, 120, 5, pred),
+                              dense_map.view_field(start, 0, 120, 5,
+                                                   dense_pred))
+        # editing as in the map editor
+        wall = map.definitions['WL']
+        dense_map[-3, 10] = wall
+        self.assertIs(wall, dense_map[-3, 10])
+        self.assertFalse(dense_map.has_action((-3, 10), 'walk'))
+        self.assertEqual(map[start], dense_map[start])
+        del dense_map[start]
+        self.assertNotIn(start, dense_map)
+        self.assertEqual(len(list(map)), len(list(dense_map)))
+
+    def test_hierarchical_path(self):
+        map = self.load_map('bigmap.yaml', cluster_size=8)
+        pred = lambda pos: map.has_action(pos, 'walk')
+        squares = sorted(pos for pos, info in map if pred(pos))
+        rand = random.Random(0)
+        for _ in range(30):
+            start, end = rand.choice(squares), rand.choice(squares)
+            path = map.get_path(start, end, pred)
+            prefix = map.get_path_prefix(start, end, pred)
+            if path is None:
+                self.assertIsNone(prefix)
+                continue
+            # an NPC makes one step of every prefix
+            cost, pos = 0, start
+            for _ in range(len(squares)):
+                if pos == end:
+                    break
+                prefix = map.get_path_prefix(pos, end, pred)
+                self.assertTrue(prefix)
+                step = prefix[0]
+                self.assertTrue(map.check_square(pos, step, pred))
+                self.assertEqual(1, max(abs(pos[0] - step[0]),
+                                        abs(pos[1] - step[1])))
+                cost += octile(pos, step)
+                pos = step
+            self.assertEqual(end, pos)
+            self.assertLessEqual(cost, self.path_cost(start, path) * 1.1)
+
+    def test_hierarchical_rebuild(self):
+        map = self.load_map('bigmap.yaml', cluster_size=8)
+        squares = sorted(pos for pos, info in map
+                         if map.has_action(pos, 'walk'))
+        wall = dict(kind='empty', actions=[])
+        rand = random.Random(1)
+        for pos in rand.sample(squares, 10):
+            map[pos] = wall
+        del map[squares[0]]
+        rebuilt = map.hierarchy
+        map.hierarchy = None
+        fresh = HierarchicalMap(map, 8)
+        self.assertEqual(fresh._borders, rebuilt._borders)
+        self.assertEqual(dict(fresh._transitions), dict(rebuilt._transitions))
+        self.assertEqual(dict((c, dict(e)) for c, e in fresh._intra.items()),
+                         dict((c, dict(e)) for c, e in rebuilt._intra.items()))
+
+    def test_region_labels(self):
+        map = self.load_map('bigmap.yaml')
+        pred = lambda pos: map.has_action(pos, 'walk')
+        squares = sorted(pos for pos, info in map if pred(pos))
+        rand = random.Random(0)
+        for _ in range(50):
+            start, end = rand.choice(squares), rand.choice(squares)
+            self.assertEqual(map.get_path(start, end, pred) is not None,
+                             map.is_reachable(start, end))
+            self.assertEqual(map.get_path(start, end, pred),
+                             map.get_path(start, end, pred, walk_pred=True))
+        wall = dict(kind='empty', actions=[])
+        floor = dict(kind='empty', actions=['walk'])
+        all_squares = sorted(pos for pos, info in map)
+        for num in range(60):
+            pos = rand.choice(all_squares)
+            if num % 3 == 0:
+                map[pos] = floor
+            elif num % 3 == 1:
+                map[pos] = wall
+            elif pos in map:
+                del map[pos]
+        regions = lambda labels: sorted(sorted(m)
+                                        for m in labels.members.values())
+        self.assertEqual(regions(RegionLabels(map)), regions(map.regions))
+        for pos, label in map.regions.labels.items():
+            self.assertIn(pos, map.regions.members[label])
+
     def test_view_field1(self):
         top = [
             'ss fd fd fd fd fd fd fd ss',
@@ -113,8 +577,10 @@ class TestMap(unittest.TestCase):
         defin = {'st':{'kind':'empty'}, 'fd': {'kind':'empty'}}
         map = self.get_map(defin, top)
         pred = lambda x: True
-        res = map.view_field(map.groups['st'][0], 90, 92, 10, pred)
-        self.assertItemsEqual(map.groups['fd'], res)
+        for algorithm in map.fov_algorithms:
+            res = map.view_field(map.groups['st'][0], 90, 92, 10, pred,
+                                 algorithm=algorithm)
+            self.assertItemsEqual(map.groups['fd'], res)
 
     def test_view_field2(self):
         top = [
@@ -128,8 +594,10 @@ class TestMap(unittest.TestCase):
         defin = {'st':{'kind':'empty'}, 'fd': {'kind':'empty'}}
         map = self.get_map(defin, top)
         pred = lambda x: True
-        res = map.view_field(map.groups['st'][0], 180, 20, 7, pred)
-        self.assertItemsEqual(map.groups['fd'], res)
+        for algorithm in map.fov_algorithms:
+            res = map.view_field(map.groups['st'][0], 180, 20, 7, pred,
+                                 algorithm=algorithm)
+            self.assertItemsEqual(map.groups['fd'], res)
 
     def test_view_field3(self):
         top = [
@@ -143,8 +611,10 @@ class TestMap(unittest.TestCase):
         defin = {'st':{'kind':'empty'}, 'fd': {'kind':'empty'}}
         map = self.get_map(defin, top)
         pred = lambda x: True
-        res = map.view_field(map.groups['st'][0], 0, 40, 6, pred)
-        self.assertItemsEqual(map.groups['fd'], res)
+        for algorithm in map.fov_algorithms:
+            res = map.view_field(map.groups['st'][0], 0, 40, 6, pred,
+                                 algorithm=algorithm)
+            self.assertItemsEqual(map.groups['fd'], res)
 
     def test_view_field4(self):
         top = [
@@ -158,8 +628,10 @@ class TestMap(unittest.TestCase):
         defin = {'st':{'kind':'empty'}, 'fd': {'kind':'empty'}}
         map = self.get_map(defin, top)
         pred = lambda x: True
-        res = map.view_field(map.groups['st'][0], 315, 60, 5, pred)
-        self.assertItemsEqual(map.groups['fd'], res)
+        for algorithm in map.fov_algorithms:
+            res = map.view_field(map.groups['st'][0], 315, 60, 5, pred,
+                                 algorithm=algorithm)
+            self.assertItemsEqual(map.groups['fd'], res)
 
     def test_segment_crossing(self):
         segm1, segm2 = ((5, 3), (-1, 3)), ((2, 1), (2, 5))
@@ -181,6 +653,63 @@ class TestMap(unittest.TestCase):
         segm1, segm2 = ((-6, 8), (-6, 3)), ((-6, 11), (-6, 2))
         self.assertIsNone(segment_crossing(segm1, segm2))
 
+    def test_crossing_mask(self):
+        rand = random.Random(0)
+        point = lambda: (rand.randint(-6, 6), rand.randint(-6, 6))
+        segments = [(point(), point()) for _ in range(200)]
+        edges = [(point(), point()) for _ in range(100)]
+        mask = crossing_mask([s for s, e in segments],
+                             [e for s, e in segments],
+                             [s for s, e in edges], [e for s, e in edges])
+        cross = lambda o, a, b: ((a[0] - o[0]) * (b[1] - o[1]) -
+                                 (a[1] - o[1]) * (b[0] - o[0]))
+        hits = 0
+        for segm, row in zip(segments, mask):
+            for edge, hit in zip(edges, row):
+                hits += hit
+                if (segment_crossing(segm, edge) is not None) == hit:
+                    continue
+                # the float reference may fail if an end touches the other
+                # segment or the crossing is compared with a horizontal one
+                self.assertTrue(segm[0][1] == segm[1][1] or
+                                edge[0][1] == edge[1][1] or
+                                0 in [cross(segm[0], segm[1], edge[0]),
+                                      cross(segm[0], segm[1], edge[1]),
+                                      cross(edge[0], edge[1], segm[0]),
+                                      cross(edge[0], edge[1], segm[1])])
+        self.assertGreater(hits, 1000)
+        squares = [(0, 0), (1, 0), (3, 2)]
+        starts, ends = square_sides_array(squares)
+        self.assertEqual(10, len(starts))
+        rays = [(2 * x, 2 * y) for x in range(-2, 5) for y in range(-2, 5)
+                if (x, y) not in squares]
+        mask = crossing_mask([(-4, -2)], rays, starts, ends).any(axis=1)
+        for ray, hit in zip(rays, mask):
+            end = ray[0] / 2, ray[1] / 2
+            touched = any(self.touches((-2, -1), end, sq) for sq in squares)
+            self.assertEqual(touched, hit, end)
+
+    def test_view_field_without_numpy(self):
+        for name in ('bigmap.yaml', 'test_map.yaml'):
+            map = self.load_map(name)
+            squares = sorted(pos for pos, info in map
+                             if map.has_action(pos, 'walk'))
+            # every seventh square is an obstacle besides walls
+            custom_pred = lambda sq: (map.has_action(sq, 'see') and
+                                      (3 * sq[0] + 5 * sq[1]) % 7)
+            rand = random.Random(0)
+            for _ in range(20):
+                pos, angle = rand.choice(squares), rand.randrange(360)
+                radius, cone_angle = rand.choice(((7, 80), (10, 120)))
+                for pred in None, custom_pred:
+                    res = map.view_field(pos, angle, cone_angle, radius,
+                                         pred, algorithm='wave')
+                    with mock.patch('map_model.map.numpy', None):
+                        expected = map.view_field(pos, angle, cone_angle,
+                                                  radius, pred,
+                                                  algorithm='wave')
+                    self.assertItemsEqual(expected, res)
+
     def test_view_field_with_obstacles1(self):
         top = [
             'ss ss ss ss st ss ss ss ss',
@@ -191,10 +720,14 @@ class TestMap(unittest.TestCase):
             'ss ss fd ss ss ss ss ss fd',
         ]
         defin = dict((i, {'kind':'empty'}) for i in ('WL', 'st', 'fd'))
+        defin['st']['actions'] = defin['fd']['actions'] = ['see']
         map = self.get_map(defin, top)
         pred = lambda pos: map[pos].get('ident') != 'WL'
-        res = map.view_field(map.groups['st'][0], 270, 120, 7, pred)
-        self.assertItemsEqual(map.groups['fd'], res)
+        for algorithm in map.fov_algorithms:
+            for p in pred, None:
+                res = map.view_field(map.groups['st'][0], 270, 120, 7, p,
+                                     algorithm=algorithm)
+                self.assertItemsEqual(map.groups['fd'], res)
 
     def test_view_field_with_obstacles2(self):
         top = [
@@ -206,10 +739,182 @@ class TestMap(unittest.TestCase):
             'ss ss ss ss ss ss ss ss fd',
         ]
         defin = dict((i, {'kind':'empty'}) for i in ('WL', 'st', 'fd'))
+        defin['st']['actions'] = defin['fd']['actions'] = ['see']
         map = self.get_map(defin, top)
         pred = lambda pos: map[pos].get('ident') != 'WL'
-        res = map.view_field(map.groups['st'][0], 230, 120, 7, pred)
-        self.assertItemsEqual(map.groups['fd'], res)
+        for algorithm in map.fov_algorithms:
+            for p in pred, None:
+                res = map.view_field(map.groups['st'][0], 230, 120, 7, p,
+                                     algorithm=algorithm)
+                self.assertItemsEqual(map.groups['fd'], res)
+
+    def touches(self, start, end, square):
+        """ exact test if the segment touches the closed square """
+        low_t, high_t = Fraction(0), Fraction(1)
+        for axis in 0, 1:
+            diff = end[axis] - start[axis]
+            low = Fraction(2 * (square[axis] - start[axis]) - 1, 2)
+            high = low + 1
+            if diff == 0:
+                if not low <= 0 <= high:
+                    return False
+                continue
+            first, second = sorted((low / diff, high / diff))
+            low_t, high_t = max(low_t, first), min(high_t, second)
+        return low_t <= high_t
+
+    def reference_view_field(self, map, pos, angle, cone_angle, radius, pred):
+        direction = cos(radians(angle)), sin(radians(angle))
+        squares, obstacles = [], []
+        for sq, info in map:
+            diff = sq[0] - pos[0], sq[1] - pos[1]
+            if (sq == pos or hypot(diff[0], diff[1]) > radius or
+                angle_between(diff, direction) > float(cone_angle) / 2):
+                continue
+            (squares if pred(sq) else obstacles).append(sq)
+        return set(sq for sq in squares
+                   if not any(self.touches(pos, sq, obst)
+                              for obst in obstacles))
+
+    def test_shadowcast_view_field_on_maps(self):
+        for name in ('bigmap.yaml', 'test_map.yaml'):
+            map = self.load_map(name)
+            pred = lambda pos: map.has_action(pos, 'see')
+            squares = sorted(pos for pos, info in map
+                             if map.has_action(pos, 'walk'))
+            rand = random.Random(0)
+            differences = total = 0
+            for _ in range(50):
+                pos, angle = rand.choice(squares), rand.randrange(360)
+                radius, cone_angle = rand.choice(((7, 80), (10, 120)))
+                res = set(map.view_field(pos, angle, cone_angle, radius,
+                                         pred, 'shadowcast'))
+                ref = self.reference_view_field(map, pos, angle, cone_angle,
+                                                radius, pred)
+                self.assertEqual(ref, res)
+                # the wave misses rays which touch corners of obstacles
+                # and squares which are not linked by visible neighbors
+                wave = set(map.view_field(pos, angle, cone_angle, radius,
+                                          pred, 'wave'))
+                differences += len(wave ^ res)
+                total += len(wave | res)
+            self.assertLess(float(differences) / total, 0.05)
+
+    def test_obstacle_edges(self):
+        top = [
+            'WL WL WL WL ss ss',
+            'ss ss ss WL ss ss',
+            'ss WL ss ss ss ss',
+        ]
+        map = self.get_map({'WL': {'kind':'empty'}}, top)
+        self.assertEqual(10, len(map.sight_edges.edges))
+        map = self.load_map('bigmap.yaml')
+        edges = map.sight_edges
+        obstacles = [pos for pos, info in map
+                     if not map.has_action(pos, 'see')]
+        self.assertItemsEqual(obstacles, edges.obstacles)
+        squares = sorted(pos for pos, info in map
+                         if map.has_action(pos, 'see'))
+        rand = random.Random(0)
+        for _ in range(300):
+            start = rand.choice(squares)
+            end = (start[0] + rand.randint(-8, 8),
+                   start[1] + rand.randint(-8, 8))
+            if end not in squares or end == start:
+                continue
+            touched = set(obst for obst in obstacles
+                          if self.touches(start, end, obst))
+            self.assertEqual(bool(touched), edges.crosses(start, end))
+            pred = lambda sq: sq[0] >= start[0]
+            self.assertEqual(any(pred(sq) for sq in touched),
+                             edges.crosses(start, end, pred))
+        # edges are rebuilt after changes
+        del map[obstacles[0]]
+        self.assertNotIn(obstacles[0], map.sight_edges.obstacles)
+
+    def test_can_see(self):
+        for name in ('bigmap.yaml', 'test_map.yaml'):
+            map = self.load_map(name)
+            pred = lambda pos: map.has_action(pos, 'see')
+            squares = sorted(pos for pos, info in map)
+            rand = random.Random(0)
+            for _ in range(30):
+                pos, angle = rand.choice(squares), rand.randrange(360)
+                radius, cone_angle = rand.choice(((7, 80), (10, 120)))
+                for algorithm in map.fov_algorithms:
+                    map.fov_algorithm = algorithm
+                    field = set(map.view_field(pos, angle, cone_angle,
+                                               radius, pred, algorithm))
+                    for x in range(pos[0] - 11, pos[0] + 12):
+                        for y in range(pos[1] - 11, pos[1] + 12):
+                            self.assertEqual((x, y) in field,
+                                             map.can_see(pos, angle,
+                                                         cone_angle, radius,
+                                                         (x, y)))
+
+    def test_batch_can_see(self):
+        map = self.load_map('bigmap.yaml')
+        squares = sorted(pos for pos, info in map
+                         if map.has_action(pos, 'walk'))
+        rand = random.Random(0)
+        observers = [(rand.choice(squares), rand.randrange(360)) +
+                     rand.choice(((80, 7), (120, 10))) for _ in range(40)]
+        targets = rand.sample(squares, 30)
+        expected = [frozenset(t for t in targets if map.can_see(*(o + (t,))))
+                    for o in observers]
+        self.assertTrue(any(expected))
+        self.assertEqual(expected, batch_can_see(map, observers, targets))
+        with mock.patch('map_model.perception.numpy', None):
+            self.assertEqual(expected, batch_can_see(map, observers, targets))
+        self.assertEqual([frozenset()] * 40,
+                         batch_can_see(map, observers, []))
+
+    def test_sight_field_cache(self):
+        top = [
+            'ss ss ss ss ss ss ss',
+            'ss ss ss WL ss ss ss',
+            'ss ss ss ss ss ss ss',
+            'ss ss ss st ss ss ss',
+        ]
+        defin = {
+            'st': {'kind': 'empty', 'actions': ['walk', 'see']},
+            'WL': {'kind': 'empty', 'actions': []}
+        }
+        data = dict(
+            substrate_texture='grass',
+            substrate_actions=['jump', 'walk', 'see'],
+            definitions=defin,
+            topology=top,
+            start_position=(0, 0),
+            escape_position=(0, 0),
+        )
+        map = Map(data=data, check=False, view_cache_size=2)
+        start = map.groups['st'][0]
+        pred = lambda pos: map.has_action(pos, 'see')
+        field = map.sight_field(start, 90, 120, 3)
+        self.assertItemsEqual(map.view_field(start, 90, 120, 3, pred), field)
+        self.assertNotIn((3, 3), field)
+        self.assertIs(field, map.sight_field(start, 90, 120, 3))
+        self.assertEqual((1, 1), (map.view_cache.hits, map.view_cache.misses))
+        map.sight_field(start, 0, 120, 3)
+        map.sight_field(start, 180, 120, 3)
+        self.assertEqual(2, len(map.view_cache))
+        self.assertIsNot(field, map.sight_field(start, 90, 120, 3))
+        self.assertEqual(4, map.view_cache.misses)
+        # perception of NPCs uses cached fields
+        self.assertTrue(map.can_see(start, 90, 120, 3, (3, 1)))
+        self.assertFalse(map.can_see(start, 90, 120, 3, (3, 3)))
+        self.assertEqual((3, 4), (map.view_cache.hits, map.view_cache.misses))
+        # editing of the map
+        map[start[0] + 1, start[1] + 1] = defin['WL']
+        self.assertEqual(0, len(map.view_cache))
+        self.assertNotIn((4, 1), map.sight_field(start, 90, 120, 3))
+        defin['WL']['actions'].append('see')
+        map.definition_changed()
+        self.assertEqual(0, len(map.view_cache))
+        field = map.sight_field(start, 90, 120, 3)
+        self.assertIn((3, 3), field)
+        self.assertIn((4, 1), field)
 
     def test_get_radial_path(self):
         top = [
@@ -0,0 +1,43 @@
+import sys
+sys.path.insert(0, '')
+
+import unittest
+import mock
+from character.movement import Movement
+from character.action import move
+
+
+class TestMovement(unittest.TestCase):
+
+    def get_char(self, pos, heading):
+        char = mock.Mock()
+        char.node.getPos.return_value = pos + (0,)
+        char.actor.getHpr.return_value = (heading, 0, 0)
+        return char
+
+    def test_update(self):
+        movement = Movement()
+        first = self.get_char((0, 0), 90)
+        second = self.get_char((2, 2), 350)
+        callback = mock.Mock()
+        movement.add(first, move((1, 0), 1.0, 0, 1.0), 10, callback)
+        movement.add(second, move((3, 3), 1.4, 20, 1.0), 10,
+                     lambda end: callback(end, 'second'))
+        self.assertEqual(2, len(movement))
+        movement.update(10.25)
+        first.node.setPos.assert_called_with(0.25, 0, 0)
+        first.actor.setH.assert_called_with(45)
+        # a short turn is finished before the step
+        self.assertAlmostEqual(380, second.actor.setH.call_args[0][0])
+        self.assertFalse(callback.called)
+        movement.update(11)
+        first.node.setPos.assert_called_with(1, 0, 0)
+        first.actor.setH.assert_called_with(0)
+        second.actor.setH.assert_called_with(380)
+        callback.assert_called_once_with(11.0)
+        self.assertEqual(1, len(movement))
+        movement.update(12)
+        second.node.setPos.assert_called_with(3, 3, 0)
+        callback.assert_called_with(11.4, 'second')
+        self.assertEqual(0, len(movement))
+        self.assertEqual(2, movement.finished)
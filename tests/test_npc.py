@@ -6,8 +6,11 @@ import unittest
 from collections import deque, defaultdict
 import mock
 from character.char import Character
-from character.npc import NPC
+from character.npc import NPC, TargetNPC
 from map_model.map import Map
+from map_model.pathpool import PathResult, PENDING, STALE
+from character import action
+from character.action import path
 from manager import Manager
 
 
@@ -25,6 +28,7 @@ class TestNPC(unittest.TestCase):
 
         S.show_view_field = False
         S.show_pathes = False
+        S.pathfinding = defaultdict(int)
         S.npc = defaultdict(int)
         S.npc.update(
             excited_view_radius=3,
@@ -60,6 +64,7 @@ class TestNPC(unittest.TestCase):
         self.npc2 = NPC(manager, None, [(0, 0)])
         self.npc2.pos = (3, 1)
         manager.npcs = {(1, 1): self.npc1, (3, 1): self.npc2}
+        self.manager = manager
 
     def test_face_to_player(self):
         npc = self.npc1
@@ -81,6 +86,205 @@ class TestNPC(unittest.TestCase):
         npc.actor.getHpr = mock.Mock(return_value=(180, 0, 0))
         self.assertEqual(2, npc.in_view_field(pl))
 
+    def test_perception(self):
+        npc1, npc2 = self.npc1, self.npc2
+        npc1.pos, npc1.view_radius, npc1.view_angle = (0, 0), 3, 120
+        npc2.view_radius, npc2.view_angle = 1, 120
+        npc1.actor.getHpr = mock.Mock(return_value=(180, 0, 0))
+        self.manager.npcs = {(0, 0): npc1, (3, 1): npc2}
+        self.manager.update_perception([npc1, npc2])
+        perception = self.manager.perception
+        self.assertEqual(frozenset([(2, 2)]), perception[npc1][2])
+        self.assertEqual(frozenset(), perception[npc2][2])
+        self.assertEqual(2, npc1.in_view_field(self.player))
+        # results are used only while they are up to date
+        perception[npc1] = perception[npc1][:2] + (frozenset(),)
+        self.assertIsNone(npc1.in_view_field(self.player))
+        npc1.actor.getHpr = mock.Mock(return_value=(190, 0, 0))
+        self.assertEqual(2, npc1.in_view_field(self.player))
+
+    def test_walk_perception(self):
+        manager, npc = self.manager, self.npc1
+        action.set_testing(True)
+        S.npc['lod_tiers'] = [[float('inf'), 1]]
+        manager.player.update_action = mock.Mock()
+        npc.speed, npc.view_radius, npc.view_angle = 1, 3, 120
+        npc.actor.getHpr = mock.Mock(return_value=(0, 0, 0))
+        map_can_see = manager.map.can_see
+        manager.map.can_see = mock.Mock(side_effect=map_can_see)
+        steps = []
+        gen = npc.do_walk()
+        self.assertIsInstance(next(gen), action.wait)
+        self.assertIsInstance(next(gen), action.decision)
+        # the manager evaluates perception of NPCs before their decisions
+        npc.request_decision(lambda: steps.append(next(gen, None)))
+        manager(mock.Mock())
+        step = steps.pop()
+        self.assertIsInstance(step, action.move)
+        self.assertEqual((0, 0), step.pos)
+        # the step is finished with the heading of it
+        npc.actor.getHpr.return_value = (step.heading, 0, 0)
+        self.assertIsInstance(gen.send(None), action.decision)
+        self.assertEqual((0, 0), npc.pos)
+        npc.request_decision(lambda: steps.append(next(gen, None)))
+        manager(mock.Mock())
+        self.assertEqual([None], steps) # the walk is over
+        self.assertEqual(npc.observer, manager.perception[npc][0])
+        self.assertEqual(2, npc.get_nearest_body.call_count)
+        self.assertFalse(manager.map.can_see.called)
+
+    def test_get_nearest_body(self):
+        npc = self.npc1
+        npc.can_see = mock.Mock(return_value=True)
+        self.assertEqual((None, None), NPC.get_nearest_body(npc))
+        body1, body2 = mock.Mock(), mock.Mock()
+        self.manager.bodies = {(4, 3): body1, (5, 3): body1,
+                               (1, 4): body2, (0, 4): body2}
+        self.assertEqual((3, body2), NPC.get_nearest_body(npc))
+        npc.can_see = lambda pos: pos[0] > 3
+        self.assertEqual((3, body1), NPC.get_nearest_body(npc))
+
+    def test_occupancy(self):
+        manager, npc = self.manager, self.npc1
+        occupancy = manager.map.occupancy
+        self.assertEqual(frozenset([(1, 1), (3, 1), (2, 2)]),
+                         manager.occupied_squares())
+        self.assertFalse(manager.is_available((2, 2)))
+        self.assertFalse(npc.path_pred((3, 1)))
+        self.assertTrue(npc.path_pred((2, 2)))
+        npc.walking = True
+        manager.map.block((1, 2))
+        self.assertTrue(manager.is_available((1, 1)))
+        self.assertFalse(npc.walk_pred((1, 2)))
+        npc.pos = (1, 2)
+        manager.map.unblock((1, 2))
+        npc.walking = False
+        self.assertEqual(frozenset([(1, 2), (3, 1), (2, 2)]),
+                         manager.occupied_squares())
+        npc.vacate()
+        self.assertTrue(occupancy.is_free((1, 2)))
+        npc.pos = (0, 0)
+        self.assertFalse(occupancy.is_free((0, 0)))
+        self.assertTrue(occupancy.is_free((1, 2)))
+
+    def test_decision_priority(self):
+        npc1, npc2 = self.npc1, self.npc2
+        npc1.pos = (2, 1)
+        npc2.target = self.player
+        npcs = [npc1, npc2]
+        key = self.manager.decision_priority
+        self.assertEqual([npc2, npc1], sorted(npcs, key=key))
+        npc2.target = (0, 0)
+        self.assertEqual([npc1, npc2], sorted(npcs, key=key))
+        npc2.must_die = True
+        self.assertEqual([npc2, npc1], sorted(npcs, key=key))
+
+    def test_lod(self):
+        npc1, npc2 = self.npc1, self.npc2
+        S.npc['lod_tiers'] = [[1, 1], [2, 3], [float('inf'), 8]]
+        npc2.pos = (5, 4)
+        self.manager.update_lod([npc1, npc2])
+        self.assertEqual(1, npc1.lod_tier)
+        self.assertEqual(2, npc2.lod_tier)
+        self.manager.player.pos = (1, 2)
+        self.manager.update_lod([npc1, npc2])
+        self.assertEqual(0, npc1.lod_tier)
+        # far NPCs skip batched perception
+        self.manager.update_perception([npc1, npc2])
+        self.assertEqual([npc1], list(self.manager.perception))
+        # an alert promotes an NPC to full fidelity
+        self.manager.alert((5, 3))
+        self.assertEqual(0, npc2.lod_tier)
+        self.manager.update_lod([npc1, npc2])
+        self.assertEqual(0, npc2.lod_tier)
+        # a far NPC waits instead of searching a detour
+        npc1.get_action = mock.Mock(return_value='walk')
+        npc1.lod_tier = 2
+        npc1.pos = (1, 0)
+        npc1.route = deque([(4, 0), (0, 0)])
+        npc1.target = (4, 0)
+        npc2.pos = (2, 0)
+        self.assertIsNone(npc1.get_next_pos())
+        self.assertIsNone(npc1.planner)
+
+    @mock.patch('manager.Body')
+    def test_action_done(self, body_mock):
+        manager, npc = self.manager, self.npc1
+        manager.ready.clear()
+        npc.action_done()
+        self.assertEqual(set([npc]), manager.ready)
+        # a dead NPC becomes a body instead
+        manager.ready.clear()
+        npc.dead = True
+        npc.action_done()
+        self.assertEqual(set(), manager.ready)
+        self.assertNotIn((1, 1), manager.npcs)
+        self.assertNotIn(npc, manager.npc_index)
+        body_mock.assert_called_once_with(npc, manager)
+
+    def test_pool_step(self):
+        npc = self.npc1
+        pool = self.manager.path_pool = mock.Mock()
+        pool.submit.return_value = 7
+        pool.result.return_value = PENDING
+        npc.get_action = mock.Mock(return_value='walk')
+        npc.target = (1, 4)
+        # the walk waits for the request while the path is searched
+        request = npc.get_next_pos()
+        self.assertIsInstance(request, path)
+        self.assertFalse(request.request.ready())
+        pool.submit.assert_called_once_with((1, 1), (1, 4))
+        self.assertIs(request.request, npc.get_next_pos().request)
+        pool.result.side_effect = [STALE, PENDING]
+        self.assertIsNot(request.request, npc.get_next_pos().request)
+        self.assertEqual(2, pool.submit.call_count)
+        pool.result.side_effect = None
+        pool.result.return_value = PathResult(((1, 2), (1, 3), (1, 4)), 0, 5)
+        self.assertEqual((1, 2), npc.get_next_pos())
+        npc.pos = (1, 2)
+        self.assertEqual((1, 3), npc.get_next_pos())
+        self.assertEqual(2, pool.submit.call_count)
+        # an occupied square of the path needs a new search
+        self.npc2.pos = (1, 4)
+        npc.pos = (1, 3)
+        pool.result.return_value = PathResult(None, 0, 3)
+        self.assertIsNone(npc.get_next_pos())
+        self.assertEqual(3, pool.submit.call_count)
+
+    def test_step_decision(self):
+        manager, npc = self.manager, self.npc1
+        S.npc['lod_tiers'] = [[1, 1], [float('inf'), 8]]
+        manager.player.update_action = mock.Mock()
+        manager.ready.clear()
+        npc.action = 'walk'
+        npc.pos = (1, 0)
+        npc.route = deque([(4, 0), (0, 0)])
+        npc.target = (4, 0)
+        manager.frame = -hash(npc) % 8 # the next frame isn't of the NPC
+        resume = mock.Mock()
+        npc.request_decision(resume)
+        self.assertEqual(set([npc]), manager.ready)
+        # a far NPC keeps the last decision on the leg of the route
+        manager(mock.Mock())
+        self.assertEqual(1, npc.lod_tier)
+        resume.assert_called_once_with((2, 0))
+        self.assertIsNone(npc.pending_decision)
+        self.assertEqual(set(), manager.ready)
+        self.assertEqual(0, manager.scheduler.decisions)
+        # off the leg the step is decided by the scheduler in its frame
+        npc.pos = (1, 1)
+        resume = mock.Mock()
+        npc.request_decision(resume)
+        for _ in range(6):
+            manager(mock.Mock())
+        self.assertFalse(resume.called)
+        self.assertEqual(set([npc]), manager.ready)
+        manager(mock.Mock())
+        resume.assert_called_once_with()
+        self.assertIsNone(npc.pending_decision)
+        self.assertEqual(set(), manager.ready)
+        self.assertEqual(1, manager.scheduler.decisions)
+
     def test_get_next_pos(self):
         npc = self.npc1
         pl = self.player
@@ -93,6 +297,88 @@ class TestNPC(unittest.TestCase):
         pl.pos = (1, 0)
         self.assertEqual((1, 0), npc.get_next_pos())
 
+    def test_route_step(self):
+        npc = self.npc1
+        map = self.manager.map
+        npc.get_action = mock.Mock(return_value='walk')
+        npc.pos = (1, 0)
+        npc.route = deque([(4, 0), (0, 0)])
+        npc.target = (4, 0)
+        self.assertEqual((2, 0), npc.get_next_pos())
+        self.assertEqual(((0, 0), (1, 0), (2, 0), (3, 0), (4, 0)),
+                         map.route_legs[(0, 0), (4, 0)])
+        self.assertIsNone(npc.planner)
+        # a detour around a character
+        self.npc2.pos = (2, 0)
+        self.assertIn(npc.get_next_pos(), ((1, 1), (2, 1)))
+        self.assertEqual(1, npc.planner.full_searches)
+        npc.pos = (2, 1)
+        self.assertIsNone(npc.route_step())
+        npc.pos = (3, 0)
+        self.assertEqual((4, 0), npc.get_next_pos())
+
+    @mock.patch('character.npc.Actor')
+    def test_escape(self, actor_mock):
+        npc = TargetNPC(self.manager, None, [(3, 3)])
+        npc.get_action = mock.Mock(return_value='walk')
+        npc.target = self.manager.map.escape_position
+        npc.pos = (1, 1)
+        self.assertEqual((0, 0), npc.get_next_pos())
+        # the player stands on the shortest path
+        npc.pos = (3, 3)
+        self.assertIn(npc.get_next_pos(), ((2, 3), (3, 2)))
+        self.assertIsNone(npc.planner)
+
+    @mock.patch('character.npc.Actor')
+    def test_escape_position(self, actor_mock):
+        manager = self.manager
+        manager.finish = mock.Mock()
+        npc = TargetNPC(manager, None, [(5, 0)])
+        npc.view_radius, npc.view_angle = 3, 120
+        npc.target = manager.map.escape_position
+        npc.pos = (2, 0)
+        # the walk goes on through the escape position to the route
+        for _ in range(4):
+            npc.pos = npc.get_next_pos()
+            if npc.pos == (0, 0):
+                manager.finish.assert_called_once_with(False)
+        self.assertNotEqual((0, 0), npc.pos)
+        manager.finish.assert_called_once_with(False)
+
+    @mock.patch('character.npc.Actor')
+    def test_escape_twice(self, actor_mock):
+        manager = self.manager
+        pool = manager.path_pool = mock.Mock()
+        npc = TargetNPC(manager, None, [(5, 0)])
+        npc.pos = (0, 0)
+        npc.pos = (1, 0)
+        npc.pos = (0, 0)
+        # the player dies or the target NPC is killed later
+        manager.finish(False)
+        manager.finish(True)
+        self.assertTrue(manager.finished)
+        base.finish_game.assert_called_once_with(False)
+        pool.close.assert_called_once_with()
+
+    def test_get_next_pos_planner(self):
+        npc = self.npc1
+        npc.get_action = mock.Mock(return_value='walk')
+        npc.target = (1, 4)
+        self.assertEqual((1, 2), npc.get_next_pos())
+        npc.pos = (1, 2)
+        self.assertEqual((1, 3), npc.get_next_pos())
+        self.assertEqual(1, npc.planner.full_searches)
+        self.assertEqual(1, npc.planner.repairs)
+        self.manager.map.block((1, 3))
+        self.assertIn(npc.get_next_pos(), ((0, 2), (2, 2)))
+        self.assertEqual(2, npc.planner.repairs)
+        npc.target = (5, 2)
+        self.assertEqual((2, 2), npc.get_next_pos())
+        self.assertEqual(2, npc.planner.full_searches)
+        stats = self.manager.planner_stats()
+        self.assertEqual(2, stats['full_searches'])
+        self.assertEqual(2, stats['repairs'])
+
     #def test_get_action(self):
         #npc = self.npc1
         #pl = self.player
@@ -165,5 +451,26 @@ class TestNPC(unittest.TestCase):
         self.assertIs(pl, npc1.target)
         self.assertEqual(tuple(), npc2.target)
 
+    def test_alert_unreachable_target(self):
+        npc1 = self.npc1
+        pl = self.player
+        map = self.manager.map
+        wall = dict(kind='empty', actions=[])
+        for pos in (4, 4), (4, 3), (5, 3):
+            map[pos] = wall
+        pl.pos = (5, 4)
+        npc1.target = tuple()
+        npc1.speed = 1
+        self.manager.alert(npc1.pos)
+        self.assertEqual(tuple(), npc1.target)
+        self.assertEqual(1, npc1.speed)
+        map[4, 4] = map.definitions['ss']
+        # the alert was processed in this tick
+        self.manager.alert(npc1.pos)
+        self.assertEqual(tuple(), npc1.target)
+        self.manager.alerts.clear() # the next tick
+        self.manager.alert(npc1.pos)
+        self.assertIs(pl, npc1.target)
+
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file
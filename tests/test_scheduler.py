@@ -0,0 +1,63 @@
+import sys
+sys.path.insert(0, '')
+
+import unittest
+import mock
+from character.scheduler import Scheduler
+
+
+class TestScheduler(unittest.TestCase):
+
+    def setUp(self):
+        self.time = 0
+        self.npcs = [mock.Mock(name=str(num)) for num in range(5)]
+        for num, npc in enumerate(self.npcs):
+            npc.priority = num
+            npc.update_action.side_effect = self.make_decision
+
+    def clock(self):
+        return self.time
+
+    def make_decision(self):
+        self.time += 0.001
+
+    def test_budget(self):
+        scheduler = Scheduler(2, 2, self.clock)
+        priority = lambda npc: npc.priority
+        npcs = self.npcs
+        scheduler.run(reversed(npcs), priority)
+        self.assertEqual([1, 1, 0, 0, 0],
+                         [n.update_action.call_count for n in npcs])
+        self.assertEqual(3, scheduler.queue_length)
+        self.assertEqual(0, scheduler.overruns)
+        scheduler.run(npcs[2:], priority)
+        self.assertEqual([1, 1, 1, 1, 0],
+                         [n.update_action.call_count for n in npcs])
+        self.assertEqual({npcs[4]: 2}, scheduler.delays)
+        # the NPC deferred max_delay frames goes first
+        scheduler.run(npcs[2:], priority)
+        self.assertEqual([1, 1, 2, 1, 1],
+                         [n.update_action.call_count for n in npcs])
+        self.assertEqual({npcs[3]: 1}, scheduler.delays)
+        npcs[0].priority = 10
+        scheduler.run(npcs, priority)
+        self.assertEqual([1, 2, 3, 1, 1],
+                         [n.update_action.call_count for n in npcs])
+        self.assertEqual({npcs[0]: 1, npcs[3]: 2, npcs[4]: 1},
+                         scheduler.delays)
+        self.assertEqual(dict(queue_length=3, overruns=0, decisions=8),
+                         scheduler.stats())
+
+    def test_overrun(self):
+        scheduler = Scheduler(0.5, 2, self.clock)
+        npcs = self.npcs
+        scheduler.run(npcs, lambda npc: npc.priority)
+        self.assertEqual(1, npcs[0].update_action.call_count)
+        self.assertEqual(4, scheduler.queue_length)
+        self.assertEqual(1, scheduler.overruns)
+        scheduler.run([], lambda npc: npc.priority)
+        self.assertEqual(0, scheduler.queue_length)
+        self.assertEqual({}, scheduler.delays)
+
+if __name__ == '__main__':
+    unittest.main()
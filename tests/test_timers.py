@@ -0,0 +1,105 @@
+import sys
+sys.path.insert(0, '')
+
+import __builtin__
+import unittest
+import mock
+from direct.interval.LerpInterval import LerpNodePathInterval
+from character.timers import TimerWheel
+from character import action
+
+
+class TestTimerWheel(unittest.TestCase):
+
+    def test_wheel(self):
+        wheel = TimerWheel(0.5, slots=4, start=2)
+        fired = []
+        wheel.add(0.5, lambda: fired.append('a'))
+        wheel.add(0, lambda: fired.append('b'))
+        wheel.add(3.2, lambda: fired.append('c')) # the next revolution
+        cancelled = wheel.add(1, lambda: fired.append('d'))
+        wheel.add(0.5, lambda: wheel.cancel(cancelled))
+        self.assertEqual(5, len(wheel))
+        wheel.advance_to(1.4)
+        self.assertEqual([], fired)
+        wheel.advance_to(1.5)
+        self.assertEqual(['a', 'b'], fired)
+        wheel.advance_to(2.9)
+        self.assertEqual(['a', 'b'], fired)
+        self.assertEqual(1, len(wheel))
+        wheel.advance_to(4)
+        self.assertEqual(['a', 'b'], fired)
+        wheel.advance_to(4.5)
+        self.assertEqual(['a', 'b', 'c'], fired)
+        self.assertEqual(4, wheel.fired)
+        self.assertEqual(0, len(wheel))
+
+
+class TestRunner(unittest.TestCase):
+
+    def setUp(self):
+        self.time = 0
+        __builtin__.globalClock = mock.Mock()
+        globalClock.getFrameTime.side_effect = lambda: self.time
+        __builtin__.taskMgr = mock.Mock()
+        action.set_testing(False)
+        action._wheel = None
+        action._intervals = []
+        action._latencies = {}
+        self.char = mock.Mock(action=None)
+
+    def frame(self, seconds):
+        task = taskMgr.add.call_args[0][0]
+        self.time += seconds
+        task(mock.Mock())
+
+    def test_runner(self):
+        # an interval is stopped until ivalLoop steps it first
+        stopped = [True]
+        interval = mock.Mock(spec=LerpNodePathInterval)
+        interval.getDuration.return_value = 0.5
+        interval.isStopped.side_effect = lambda: stopped
+        request = mock.Mock(result='path')
+        request.ready.return_value = False
+        results = []
+        @action.action
+        def do_step(char):
+            yield action.wait(0.1)
+            results.append((yield action.path(request)))
+            yield interval
+            yield interval
+        do_step(self.char)
+        self.assertEqual('step', self.char.action)
+        taskMgr.add.assert_called_once()
+        self.frame(0.1)
+        self.frame(0.1)
+        self.assertEqual([], results)
+        request.ready.return_value = True
+        self.frame(0.02)
+        self.assertEqual(['path'], results)
+        interval.start.assert_called_once_with()
+        self.assertEqual(1, action.stats()['intervals'])
+        self.frame(0.02)
+        self.assertEqual(1, interval.start.call_count)
+        del stopped[:]
+        # the interval is resumed in the frame when it's stopped
+        self.frame(0.38)
+        stopped.append(True)
+        self.frame(0.02)
+        self.assertEqual(2, interval.start.call_count)
+        self.assertFalse(interval.finish.called)
+        # or finished when its duration is over
+        del stopped[:]
+        self.frame(0.49)
+        self.assertEqual('step', self.char.action)
+        self.frame(0.02)
+        interval.finish.assert_called_once_with()
+        self.assertIsNone(self.char.action)
+        self.char.action_done.assert_called_once_with()
+        self.assertEqual(dict(pending=0, fired=8, intervals=0, steps=0),
+                         action.stats())
+        taskMgr.add.assert_called_once()
+        histogram = dict(action.latency_histogram()['step'])
+        self.assertEqual(2, histogram[0])
+        self.assertEqual(1, histogram[10])
+        self.assertEqual(3, sum(histogram.values()))